@@ -7,7 +7,10 @@
 
 import argparse
 from Bio import SeqIO
-import json
+from gisaid_json import read_records
+from genome_store import GenomeStore
+from strain_names import gisaid_name
+from sequence_qc import sequence_size
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -19,6 +22,7 @@ if __name__ == '__main__':
     parser.add_argument("--keep", required=True, help="TXT file with accession number of genomes to be included")
     parser.add_argument("--remove", required=True, help="TXT file with accession number of genomes to be removed")
     parser.add_argument("--output", required=True, help="FASTA file containing filtered sequences")
+    parser.add_argument("--store", required=False, help="Genome store (see genome_store.py) used to index and fetch GISAID genomes")
     args = parser.parse_args()
 
     genomes = args.genomes
@@ -26,6 +30,7 @@ if __name__ == '__main__':
     keep = args.keep
     remove = args.remove
     outfile = args.output
+    store = args.store
 
     # genomes = path + "pre-analyses/provision.json"
     # # genomes = path + "pre-analyses/gisaid_hcov-19.fasta"
@@ -45,7 +50,7 @@ if __name__ == '__main__':
     low_coverage = {}
     for fasta in SeqIO.parse(open(new_genomes), 'fasta'):
         id, seq = fasta.description, fasta.seq
-        size = len(str(seq).replace('N', '').replace('-', ''))
+        size = sequence_size(str(seq))
         if size > min_size:
             coverage = str(round(size / genome_size, 3))
             print(id + ', coverage = ' + coverage + ' (PASS)')
@@ -57,91 +62,103 @@ if __name__ == '__main__':
             low_coverage[id] = coverage
     print('\nDone!\n')
 
-    # create a list of sequences to be added in all instances
+    # create a set of sequences to be added in all instances (list keeps the keep.txt order)
     keep_sequences = []
+    keep_set = set()
     for id in open(keep, "r").readlines():
         if id[0] not in ["#", "\n"]:
             id = id.strip().replace('hCoV-19/', '')
-            if id not in newly_sequenced:
-                if id not in keep_sequences:
-                    keep_sequences.append(id)
+            if id not in newly_sequenced and id not in keep_set:
+                keep_sequences.append(id)
+                keep_set.add(id)
 
-    # create a list of sequences to be ignored in all instances
-    remove_sequences = []
+    # create a set of sequences to be ignored in all instances
+    remove_sequences = set()
     for id in open(remove, "r").readlines():
         if id[0] not in ["#", "\n"]:
             id = id.strip()
-            remove_sequences.append(id)
+            remove_sequences.add(id)
 
     # export only sequences to be used in the nextstrain build
+    # records are streamed one at a time, and only IDs listed in keep.txt are stored
     c = 1
     print('\n### Exporting sequences\n')
-    exported = []
-    ignored = []
-    all_sequences = []
+    exported = 0
+    ignored = 0
+    total_genomes = 0
+    found = set()
     with open(outfile, 'w') as output:
-        if genomes.split('.')[1] == 'json':
-            with open(genomes) as infile:
-                c = 0
-                for line in infile:
-                    try:
-                        entry = json.loads(line)
-                        id = entry['covv_virus_name']
-                        id = id.split('|')[0].replace('hCoV-19/', '')
-                        if len(id.split('/')) == 3:
-                            country, index, year = id.split('/')
-                        elif len(id.split('/')) == 4:
-                            host, country, index, year = id.split('/')
-                        country = country.replace(' ', '').replace('\'', '-').replace('_', '')
-                        id = '/'.join([country, index, year])
-
-                        all_sequences.append(id)
-                        if id not in remove_sequences:
-                            if id in keep_sequences:  # filter out unwanted sequences
-                                seq = entry['sequence'].replace('\n', '')
-                                if int(len(seq)) >= min_size:
-                                    entry = ">" + id + "\n" + seq.upper() + "\n"
-                                    exported.append(id)
-                                    output.write(entry)
-                                    print(str(c) + '. ' + id)
-                                    c += 1
-                        else:
-                            ignored.append(id)
-                    except:
-                        print('Corrupted JSON row detected. Skipping...')
+        if store != None:
+            # fetch only the listed genomes from the indexed store, updating it if the input file changed
+            if genomes.split('.')[1] == 'json':
+                c = 0  # numbering of JSON records starts at 0, as when reading the file itself
+            with GenomeStore(store) as gs:
+                print('Updating genome store: ' + str(gs.update(genomes)) + ' genomes indexed\n')
+                total_genomes = gs.count(genomes)
+                ignored = gs.count_matches(remove_sequences, genomes)
+                for header, id, seq in gs.fetch(keep_set, genomes):
+                    found.add(id)
+                    if id not in remove_sequences:
+                        if genomes.split('.')[1] != 'json' or int(len(seq)) >= min_size:
+                            output.write(">" + id + "\n" + seq.upper() + "\n")
+                            exported += 1
+                            print(str(c) + '. ' + id)
+                            c += 1
+
+        elif genomes.split('.')[1] == 'json':
+            c = 0
+            for entry in read_records(genomes, fields=['covv_virus_name', 'sequence']):
+                try:
+                    id = gisaid_name(entry['covv_virus_name'])
+                    if id is None:
+                        print('Unexpected sequence header: ' + entry['covv_virus_name'] + '. Skipping...')
+                        continue
+
+                    total_genomes += 1
+                    if id in keep_set:
+                        found.add(id)
+                    if id not in remove_sequences:
+                        if id in keep_set:  # filter out unwanted sequences
+                            seq = entry['sequence'].replace('\n', '')
+                            if int(len(seq)) >= min_size:
+                                output.write(">" + id + "\n" + seq.upper() + "\n")
+                                exported += 1
+                                print(str(c) + '. ' + id)
+                                c += 1
+                    else:
+                        ignored += 1
+                except:
+                    print('Corrupted JSON row detected. Skipping...')
 
         else:
             for fasta in SeqIO.parse(open(genomes), 'fasta'):
-                id, seq = fasta.description, fasta.seq
-                id = id.split('|')[0].replace('hCoV-19/', '')
-                if len(id.split('/')) == 3:
-                    country, index, year = id.split('/')
-                elif len(id.split('/')) == 4:
-                    host, country, index, year = id.split('/')
-                country = country.replace(' ', '').replace('\'', '-').replace('_', '')
-                id = '/'.join([country, index, year])
-                all_sequences.append(id)
-
+                id = gisaid_name(fasta.description)
+                if id is None:
+                    print('Unexpected sequence header: ' + fasta.description + '. Skipping...')
+                    continue
+
+                total_genomes += 1
+                if id in keep_set:
+                    found.add(id)
                 if id not in remove_sequences:
-                    if id in keep_sequences:  # filter out unwanted sequences
-                        entry = ">" + id + "\n" + str(seq).upper() + "\n"
-                        exported.append(id)
-                        output.write(entry)
+                    if id in keep_set:  # filter out unwanted sequences
+                        output.write(">" + id + "\n" + str(fasta.seq).upper() + "\n")
+                        exported += 1
                         print(str(c) + '. ' + id)
                         c += 1
                 else:
-                    ignored.append(id)
+                    ignored += 1
 
         for id, seq in newly_sequenced.items():
             print('* ' + str(c) + '. ' + id)
             entry = ">" + id + "\n" + seq.upper() + "\n"
-            exported.append(id)
+            exported += 1
             output.write(entry)
             c += 1
     print('\n- Done!\n')
 
     # mismatched sequence headers
-    mismatch = [genome for genome in keep_sequences if genome not in all_sequences]
+    mismatch = [genome for genome in keep_sequences if genome not in found]
     if len(mismatch) + len(low_coverage) > 0:
         print('\n### WARNINGS!')
 
@@ -165,11 +182,11 @@ if __name__ == '__main__':
 
     print('Lab file contains ' + str(len(newly_sequenced)) + ' high coverage sequences')
     print('Lab file contains ' + str(len(low_coverage)) + ' low coverage sequences, which were ignored')
-    print('GISAID file contains ' + str(len(all_sequences)) + ' sequences\n')
+    print('GISAID file contains ' + str(total_genomes) + ' sequences\n')
 
     print(str(len(mismatch)) + ' genomes in keep.txt were NOT FOUND on GISAID database')
     print(str(len(keep_sequences)) + ' genomes ADDED from GISAID dataset')
     print(str(len(newly_sequenced)) + ' newly sequenced genomes were added')
     print(str(len(low_coverage)) + ' low coverage genomes were ignored')
-    print(str(len(ignored)) + ' genomes were REMOVED according to remove.txt\n')
-    print(str(len(exported)) + ' genomes included in FINAL dataset\n')
+    print(str(ignored) + ' genomes were REMOVED according to remove.txt\n')
+    print(str(exported) + ' genomes included in FINAL dataset\n')
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import argparse
 from Bio import SeqIO
+from sequence_qc import sequence_size
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -38,7 +39,7 @@ if __name__ == '__main__':
     low_coverage = {}
     for fasta in SeqIO.parse(open(new_genomes),'fasta'):
         id, seq = fasta.description, fasta.seq
-        size = len(str(seq).replace('N', '').replace('-', ''))
+        size = sequence_size(str(seq))
         if size > min_size:
             coverage = str(round(size / genome_size, 3))
             print(id + ', coverage = ' + coverage + ' (PASS)')
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Binary alignment container: a fixed-width uint8 matrix (one row per sequence)
+saved as a .npy file that can be memory-mapped, plus a sidecar with row names.
+
+    <prefix>.npy    -> uint8 matrix, shape (sequences, alignment length)
+    <prefix>.names  -> sequence headers, one per line, in row order
+
+Rows and columns can then be sliced without parsing text. Run as a script to
+convert a matrix back to FASTA (for augur), or a FASTA alignment into a matrix.
+"""
+
+import argparse
+import struct
+import numpy as np
+
+header_size = 128  # bytes reserved for the .npy header, written once the number of rows is known
+
+
+def _npy_header(rows, length):
+    header = repr({'descr': '|u1', 'fortran_order': False, 'shape': (rows, length)})
+    header = header.ljust(header_size - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class MatrixWriter:
+    ''' Append aligned sequences (bytes of equal length) to a matrix, streaming rows to disk.
+    Sequences of any other length are left out of the matrix, with a warning '''
+    def __init__(self, prefix, length):
+        self.prefix = prefix
+        self.length = length
+        self.rows = 0
+        self.skipped = 0
+        self.matrix = open(prefix + '.npy', 'wb')
+        self.matrix.write(b'\0' * header_size)
+        self.names = open(prefix + '.names', 'w')
+
+    def append(self, header, seq):
+        ''' Add a row, returning False if the sequence was skipped for not having the length of the matrix '''
+        if len(seq) != self.length:
+            print('\t* WARNING! ' + header + ' has ' + str(len(seq)) + ' sites instead of ' + str(self.length) + ', not added to ' + self.prefix + '.npy')
+            self.skipped += 1
+            return False
+        self.matrix.write(seq)
+        self.names.write(header + '\n')
+        self.rows += 1
+        return True
+
+    def close(self):
+        self.matrix.seek(0)
+        self.matrix.write(_npy_header(self.rows, self.length))
+        self.matrix.close()
+        self.names.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_matrix(prefix, mode='r'):
+    ''' Return (list of names, memory-mapped uint8 matrix) '''
+    names = [line.rstrip('\n') for line in open(prefix + '.names')]
+    return names, np.load(prefix + '.npy', mmap_mode=mode)
+
+
+def write_fasta(prefix, output, chunk_size=5000):
+    names, matrix = load_matrix(prefix)
+    with open(output, 'wb') as outfile:
+        for start in range(0, len(names), chunk_size):
+            rows = matrix[start:start + chunk_size]
+            outfile.write(b''.join(b'>' + name.encode() + b'\n' + row.tobytes() + b'\n'
+                                   for name, row in zip(names[start:start + chunk_size], rows)))
+    return len(names)
+
+
+def read_fasta_matrix(fasta, prefix):
+    from genome_store import read_fasta
+
+    writer = None
+    try:
+        for header, seq in read_fasta(fasta):
+            if writer is None:
+                writer = MatrixWriter(prefix, len(seq))
+            writer.append(header, seq.encode())
+    finally:
+        if writer is not None:
+            writer.close()
+    return writer.rows if writer is not None else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Convert alignments between FASTA and memory-mapped matrix (.npy + .names) formats",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--input", required=True, help="FASTA alignment, or prefix of a matrix alignment")
+    parser.add_argument("--output", required=True, help="Prefix of the matrix alignment, or FASTA file")
+    parser.add_argument("--to", required=True, nargs=1, type=str, choices=['fasta', 'matrix'], help="Output format")
+    args = parser.parse_args()
+
+    if args.to[0] == 'fasta':
+        total = write_fasta(args.input, args.output)
+    else:
+        total = read_fasta_matrix(args.input, args.output)
+    print('\n' + str(total) + ' sequences successfully exported to ' + args.output + '\n')
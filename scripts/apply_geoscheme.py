@@ -1,10 +1,96 @@
 # -*- coding: utf-8 -*-
 
-import pycountry_convert as pyCountry
-import pycountry
 import pandas as pd
+import numpy as np
 import argparse
-from uszipcode import SearchEngine
+from iso_codes import get_iso
+
+
+#keys to correct ISOs for colonies
+colonies =  {'British Virgin Islands':'VGB','Cayman Islands':'CYM','Guam':'GUM','US Virgin Islands':'VIR','Virgin Islands':'VIR',
+            'Puerto Rico':'PRI','Northern Mariana Islands':'MNP','Sint Maarten':'MAF','Sint Eustatius':'BES','St Eustatius':'BES',
+            'Bonaire':'BES','Saba':'BES','Martinique':'MTQ','French Guiana':'GUF','Montserrat':'MSR','Turks and Caicos':'TCA',
+            'Anguilla':'AIA','Mayotte':'MYT','Reunion':'RUE','Wallis and Futuna':'WLF'}
+#keys to correct regions for colonies
+colony_regions =  {'British Virgin Islands':'Caribbean','Cayman Islands':'Caribbean','Guam':'Oceania','US Virgin Islands':'Caribbean','Virgin Islands':'Caribbean',
+            'Puerto Rico':'Caribbean','Northern Mariana Islands':'Oceania','Sint Maarten':'Caribbean','Sint Eustatius':'Caribbean','St Eustatius':'Caribbean',
+            'Bonaire':'Caribbean','Saba':'Caribbean','Martinique':'Caribbean','French Guiana':'South America','Montserrat':'Caribbean','Turks and Caicos':'Caribbean',
+            'Anguilla':'Caribbean','Mayotte':'Eastern Africa','Reunion':'Eastern Africa','Wallis and Futuna':'Oceania'}
+#keys to correct common misspellings (in GISAID or in our metadata)
+misspelled =    {'Virgin Islands':'US Virgin Islands','St Eustatius':'Sint Eustatius','Turks and Caicos Islands':'Turks and Caicos'}
+
+
+def read_geolevels(geoscheme):
+    ''' {member: name} of subcontinental regions (keyed by ISO codes of their countries), subnational regions and subareas of a geoscheme '''
+    scheme_list = open(geoscheme, "r").readlines()[1:]
+    geoLevels = {}
+    for line in scheme_list:
+        if not line.startswith('\n'):
+            id = line.split('\t')[2]
+            type = line.split('\t')[0]
+            if type == 'region':
+                members = line.split('\t')[5].split(',') # elements inside the subarea
+                for country in members:
+                    country = country.strip()
+                    iso = colonies[country] if country in colonies else get_iso(country)  # ISO codes of colonies, as in metadata
+                    geoLevels[iso] = id
+
+            # parse subnational regions for countries in geoscheme
+            if type == 'country':
+                members = line.split('\t')[5].split(',') # elements inside the subarea
+                for state in members:
+                    if state.strip() not in geoLevels.keys():
+                        geoLevels[state.strip()] = id
+
+            # parse subareas for states in geoscheme
+            if type == 'location':
+                members = line.split('\t')[5].split(',')  # elements inside the subarea
+                for zipcode in members:
+                    if zipcode.strip() not in geoLevels.keys():
+                        geoLevels[zipcode.strip()] = id
+    return geoLevels
+
+
+def apply_scheme(dfN, geoLevels, focus):
+    ''' Convert sets of locations into sub-locations, and correct names, ISO codes and regions of the metadata '''
+    # each step below is applied column-wise, with boolean masks and dict lookups (Series.map)
+    dfN.fillna('', inplace=True)
+    country = dfN['country'].copy()  # original values, used for the misspelling fixes below
+
+    # flatten divison names as country names, for countries that are not a focus of study
+    flatten = ~country.isin(focus) & ~dfN['division'].isin(focus)
+    dfN.loc[flatten, 'division'] = country[flatten]
+    division = dfN['division'].copy()
+
+    # assign US region
+    europe = dfN['region'].astype(str).str.contains('Europe', regex=False)
+    dfN['us_region'] = np.where(country != 'USA', np.where(europe, 'Europe', 'Global'), division)
+
+    # divide country into subnational regions
+    subnational = division.map(geoLevels)
+    mask = ~division.isin(['', 'unknown']) & subnational.notna()
+    dfN.loc[mask, 'country'] = subnational[mask]
+
+    # correct ISO codes and regions for colonies (any insular terrritories)
+    mask = dfN['country'].isin(colonies.keys())
+    dfN.loc[mask, 'iso'] = dfN.loc[mask, 'country'].map(colonies)
+    dfN.loc[mask, 'region'] = dfN.loc[mask, 'country'].map(colony_regions)
+
+    # flatten location names as division names for divisions that are not a focus of study
+    mask = ~division.isin(focus)
+    dfN.loc[mask, 'location'] = division[mask]
+
+    # rename some commonly misspelled or mismatched data
+    mask = country.isin(misspelled.keys())
+    dfN.loc[mask, 'country'] = country[mask].map(misspelled)
+    for column in ['division', 'location']:
+        mask = dfN[column].isin(misspelled.keys())
+        dfN.loc[mask, column] = dfN.loc[mask, column].map(misspelled)
+
+    # rename Florida, PR
+    mask = dfN['country'].isin(['Puerto Rico']) & dfN['location'].isin(['Florida'])
+    dfN.loc[mask, 'location'] = 'Florida (PR)'
+    return dfN
 
 
 if __name__ == '__main__':
@@ -43,65 +129,8 @@ if __name__ == '__main__':
         focus = []
     print(focus)
 
-    # get ISO alpha3 country codes
-    isos = {'British Virgin Islands':'VGB','Cayman Islands':'CYM','Guam':'GUM','US Virgin Islands':'VIR','Virgin Islands':'VIR',
-            'Puerto Rico':'PRI','Northern Mariana Islands':'MNP','Sint Maarten':'MAF','Sint Eustatius':'BES','St Eustatius':'BES',
-            'Bonaire':'BES','Saba':'BES','Martinique':'MTQ','French Guiana':'GUF','Montserrat':'MSR','Turks and Caicos':'TCA',
-            'Anguilla':'AIA','Mayotte':'MYT','Reunion':'RUE','Wallis and Futuna':'WLF'}
-    def get_iso(country):
-        global isos
-        if country not in isos.keys():
-            try:
-                isoCode = pyCountry.country_name_to_country_alpha3(country, cn_name_format="default")
-                isos[country] = isoCode
-            except:
-                try:
-                    isoCode = pycountry.countries.search_fuzzy(country)[0].alpha_3
-                    isos[country] = isoCode
-                except:
-                    isos[country] = ''
-        return isos[country]
-
-    #keys to correct ISOs for colonies
-    colonies =  {'British Virgin Islands':'VGB','Cayman Islands':'CYM','Guam':'GUM','US Virgin Islands':'VIR','Virgin Islands':'VIR',
-                'Puerto Rico':'PRI','Northern Mariana Islands':'MNP','Sint Maarten':'MAF','Sint Eustatius':'BES','St Eustatius':'BES',
-                'Bonaire':'BES','Saba':'BES','Martinique':'MTQ','French Guiana':'GUF','Montserrat':'MSR','Turks and Caicos':'TCA',
-                'Anguilla':'AIA','Mayotte':'MYT','Reunion':'RUE','Wallis and Futuna':'WLF'}
-    #keys to correct regions for colonies
-    colony_regions =  {'British Virgin Islands':'Caribbean','Cayman Islands':'Caribbean','Guam':'Oceania','US Virgin Islands':'Caribbean','Virgin Islands':'Caribbean',
-                'Puerto Rico':'Caribbean','Northern Mariana Islands':'Oceania','Sint Maarten':'Caribbean','Sint Eustatius':'Caribbean','St Eustatius':'Caribbean',
-                'Bonaire':'Caribbean','Saba':'Caribbean','Martinique':'Caribbean','French Guiana':'South America','Montserrat':'Caribbean','Turks and Caicos':'Caribbean',
-                'Anguilla':'Caribbean','Mayotte':'Eastern Africa','Reunion':'Eastern Africa','Wallis and Futuna':'Oceania'}
-    #keys to correct common misspellings (in GISAID or in our metadata)
-    misspelled =    {'Virgin Islands':'US Virgin Islands','St Eustatius':'Sint Eustatius','Turks and Caicos Islands':'Turks and Caicos'}
-
     # parse subcontinental regions in geoscheme
-    scheme_list = open(geoscheme, "r").readlines()[1:]
-    geoLevels = {}
-    c = 0
-    for line in scheme_list:
-        if not line.startswith('\n'):
-            id = line.split('\t')[2]
-            type = line.split('\t')[0]
-            if type == 'region':
-                members = line.split('\t')[5].split(',') # elements inside the subarea
-                for country in members:
-                    iso = get_iso(country.strip())
-                    geoLevels[iso] = id
-
-            # parse subnational regions for countries in geoscheme
-            if type == 'country':
-                members = line.split('\t')[5].split(',') # elements inside the subarea
-                for state in members:
-                    if state.strip() not in geoLevels.keys():
-                        geoLevels[state.strip()] = id
-
-            # parse subareas for states in geoscheme
-            if type == 'location':
-                members = line.split('\t')[5].split(',')  # elements inside the subarea
-                for zipcode in members:
-                    if zipcode.strip() not in geoLevels.keys():
-                        geoLevels[zipcode.strip()] = id
+    geoLevels = read_geolevels(geoscheme)
 
 
     # open metadata file as dataframe
@@ -117,60 +146,11 @@ if __name__ == '__main__':
 
     # convert sets of locations into sub-locations
     print('\nApplying geo-schemes...')
-    dfN.fillna('', inplace=True)
-    for idx, row in dfN.iterrows():
-
-        # flatten divison names as country names, for countries that are not a focus of study
-        country = dfN.loc[idx, 'country']
-        division = dfN.loc[idx,'division']
-        if country not in focus:
-            if division not in focus:
-                dfN.loc[idx, 'division'] = country
-
-        # assign US region
-        if country not in ['USA']:
-            if 'Europe' in dfN.loc[idx, 'region']:
-                dfN.loc[idx, 'us_region'] = 'Europe'
-            else:
-                dfN.loc[idx, 'us_region'] = 'Global'
-        if country == 'USA' and dfN.loc[idx, 'us_region'] == '':
-            dfN.loc[idx, 'us_region'] = dfN.loc[idx, 'division']
-
-        # divide country into subnational regions
-        division = dfN.loc[idx, 'division']
-        if division not in ['', 'unknown']:
-            if division in geoLevels.keys():
-                dfN.loc[idx, 'country'] = geoLevels[dfN.loc[idx, 'division']]
-
-        # correct ISO codes and regions for colonies (any insular terrritories)
-        island = dfN.loc[idx,'country']
-        if island in colonies.keys():
-            dfN.loc[idx,'iso'] = colonies[island]
-            dfN.loc[idx,'region'] = colony_regions[island]
-
-
-        # flatten location names as division names for divisions that are not a focus of study
-        if division not in focus:
-            dfN.loc[idx, 'location'] = division
-        #print('Processing metadata for... ' + row['strain'])
-
-        #rename some commonly misspelled or mismatched data
-        if country in misspelled:
-            dfN.loc[idx,'country'] = misspelled[country]
-        if division in misspelled:
-            dfN.loc[idx,'division'] = misspelled[division]
-        location = dfN.loc[idx,'location']
-        if location in misspelled:
-            dfN.loc[idx,'location'] = misspelled[location]
-
-        #rename Florida, PR
-        if dfN.loc[idx,'country'] in ['Puerto Rico']:
-            if dfN.loc[idx,'location'] in ['Florida']:
-                dfN.loc[idx,'location'] = 'Florida (PR)'
+    dfN = apply_scheme(dfN, geoLevels, focus)
 
 
 
     dfN = dfN.drop_duplicates(subset=['strain'])
     dfN.to_csv(output, sep='\t', index=False)
 
-print('\nMetadata file successfully reformatted applying geo-scheme!\n')
+    print('\nMetadata file successfully reformatted applying geo-scheme!\n')
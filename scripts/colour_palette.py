@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Colour palette of the build: dark and light HEX colours of each hue in the colour
+grid (HTML), and the 'jet' colour map used for variant categories.
+
+The grid is parsed once, and compiled to a JSON file stored next to it, keyed by
+the checksum of the grid. BeautifulSoup and matplotlib are only imported when
+that file needs to be rebuilt. Gradients are interpolated with NumPy.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+limits = {'dark': (60, 30), 'light': (100, 80)}  # define saturation and luminance, max and min, respectively
+
+
+def grid_digest(path):
+    return hashlib.sha1(open(path, 'rb').read()).hexdigest()
+
+
+def parse_grid(path):
+    ''' {hue: (dark HEX, light HEX)} from the tables of the colour grid '''
+    from bs4 import BeautifulSoup as BS
+
+    html = BS(open(path, "r").read(), 'html.parser')
+    hue_to_hex = {}
+    for table in html.find_all('table'):
+        string_head = str(table.caption)
+        if string_head == 'None':
+            continue
+        hue_value = int(string_head.split('"')[1])
+
+        lum_value = 90  # brightest colour
+        hexdark = ''
+        hexligth = ''
+        for row in table.tbody.find_all('tr'):
+            sat_value = 10  # unsaturated colour
+            for cell in row.find_all('td'):
+                if sat_value == limits['dark'][0] and lum_value == limits['dark'][1]:
+                    hexdark = cell.text.strip()
+                if sat_value == limits['light'][0] and lum_value == limits['light'][1]:
+                    hexligth = cell.text.strip()
+                sat_value += 10
+            lum_value -= 10
+        hue_to_hex[hue_value] = (hexdark, hexligth)
+    return hue_to_hex
+
+
+def jet_table():
+    ''' RGB lookup table (256 x 3) of the matplotlib 'jet' colour map '''
+    from matplotlib import cm
+    return cm.jet(np.arange(cm.jet.N))[:, :3].tolist()
+
+
+def load_palette(grid, cache=None):
+    ''' Return ({hue: (dark HEX, light HEX)}, jet lookup table), compiling the grid if its cache is missing or outdated '''
+    if cache is None:
+        cache = os.path.splitext(grid)[0] + '.json'
+    digest = grid_digest(grid)
+    if os.path.exists(cache):
+        try:
+            palette = json.load(open(cache))
+            if palette.get('grid') == digest:
+                return {int(hue): tuple(pair) for hue, pair in palette['hues'].items()}, np.array(palette['jet'])
+        except ValueError:
+            pass
+
+    print('Compiling colour grid ' + grid + ' into ' + cache)
+    hue_to_hex = parse_grid(grid)
+    jet = jet_table()
+    with open(cache, 'w') as outfile:
+        json.dump({'grid': digest, 'hues': {str(hue): list(pair) for hue, pair in hue_to_hex.items()}, 'jet': jet}, outfile)
+    return hue_to_hex, np.array(jet)
+
+
+# convert colour codes
+def rgb_to_hex(rgb):
+    ''' [[255,255,255], ...] -> ["#ffffff", ...] '''
+    return ['#%02x%02x%02x' % tuple(row) for row in np.asarray(rgb).astype(int).tolist()]
+
+
+def hex_to_rgb(hex):
+    ''' "#FFFFFF" -> [255,255,255] '''
+    return np.array([int(hex[i:i + 2], 16) for i in range(1, 6, 2)])
+
+
+def linear_gradient(start_hex, finish_hex, n):
+    ''' List of n HEX colours evenly spaced between two HEX colours ("#FFFFFF"), both included '''
+    s = hex_to_rgb(start_hex)
+    f = hex_to_rgb(finish_hex)
+    steps = np.arange(1, n) / float(n - 1) if n > 1 else np.zeros(0)
+    rgb = np.vstack([s, s + steps[:, None] * (f - s)])
+    return rgb_to_hex(rgb)
+
+
+def jet_colours(jet, hues, luminance=0.7):
+    ''' HEX colours of hues (0-240) in the 'jet' colour map, darkened by a luminance factor '''
+    index = (np.asarray(hues, dtype=float) / 240 * 255).astype(int)
+    return rgb_to_hex(jet[np.minimum(index, len(jet) - 1)] * 255 * luminance)
@@ -2,6 +2,9 @@
 
 from Bio import SeqIO
 import argparse
+from genome_store import GenomeStore
+from strain_names import strain_name, simple_name
+from sequence_qc import sequence_size
 
 
 if __name__ == '__main__':
@@ -14,12 +17,14 @@ if __name__ == '__main__':
     parser.add_argument("--max-missing", required=False, type=int,  default='30', help="Maximum percentage of Ns or gaps (int: 1-100)")
     parser.add_argument("--how", required=False, nargs=1, type=str,  default='separate', choices=['separate', 'append', 'mock'],
                         help="How new sequences will be exported? In a 'separate' file; appended to the 'input' file, or not exported at all ('mock')?")
+    parser.add_argument("--store", required=False, help="Genome store (see genome_store.py) used to index the pre-existing dataset")
     args = parser.parse_args()
 
     dataset = args.dataset
     new_genomes = args.new_genomes
     max_gaps = args.max_missing
     how = args.how[0]
+    store = args.store
     genome_size = 29420
 
     # path = "/Users/anderson/GLab Dropbox/Anderson Brito/projects/ncov_2ndWave/nextstrain/test/"
@@ -30,27 +35,32 @@ if __name__ == '__main__':
 
     print('\n### Scanning existing sequences...\n')
     # scan pre-existing dataset
-    preexisting = []
+    preexisting = set()
     duplicates = []
     too_small = []
-    for entry in SeqIO.parse(open(dataset),'fasta'):
-        id, seq = entry.description, str(entry.seq)
-        id = id.replace('hCoV-19/', '').split('|')[0].replace(' ', '')
-        size = len(seq.replace('N', '').replace('-', ''))
+    if store != None:
+        # headers and genome sizes are read from the store index, without loading sequences
+        with GenomeStore(store) as gs:
+            gs.update(dataset)
+            records = [(header, size) for header, strain, size in gs.headers(dataset)]
+    else:
+        records = ((entry.description, sequence_size(str(entry.seq))) for entry in SeqIO.parse(open(dataset), 'fasta'))
+    for id, size in records:
+        id = strain_name(id)
         min_size = genome_size - int(genome_size * max_gaps/100)
         if size < min_size:
             # too_small.append(id)
             print('Partial genome (' + str(size) + ' bp): ' + id + ' is too short.')
         else:
             if id not in preexisting:
-                preexisting.append(id)
+                preexisting.add(id)
             else:
                 duplicates.append(id)
     # print(preexisting)
     print('Done!')
 
 
-    preexist_simple = list(map(lambda strain: str(strain).replace('-', '').replace('_', ''), preexisting))
+    preexist_simple = set(simple_name(strain) for strain in preexisting)
 
     # open output file
     outfile = ''
@@ -71,14 +81,14 @@ if __name__ == '__main__':
     new_entries = []
     for entry in SeqIO.parse(open(new_genomes),'fasta'):
         id, seq = entry.description, str(entry.seq)
-        strain = id.replace('hCoV-19/', '').split('|')[0].replace(' ', '')
-        size = len(seq.replace('N', '').replace('-', ''))
+        strain = strain_name(id)
+        size = sequence_size(seq)
         min_size = genome_size - int(genome_size * max_gaps/100)
         if size < min_size:
             print('Partial genome: ' + str(size) + ' bp ' + ' - ' + id + ' is too short, and was ignored...')
             too_small.append(id)
         else:
-            if strain not in preexisting and strain.replace('-', '').replace('_', '') not in preexist_simple:
+            if strain not in preexisting and simple_name(strain) not in preexist_simple:
                 print('+ ' + strain + ': new genome')
                 entry = '>' + strain + '\n' + str(seq) + '\n'
                 if how != 'mock':
@@ -9,7 +9,13 @@
 
 from Bio import Entrez
 from Bio import SeqIO
+from entrez_fetcher import EntrezFetcher
+from download_state import DownloadState
+import genbank_stream
+from io import StringIO
 import time
+import csv
+import os
 import numpy as np
 import argparse
 import pandas as pd
@@ -26,6 +32,12 @@ if __name__ == '__main__':
     parser.add_argument("--fasta", required=True, help="FASTA file with all existing genomes already downloaded")
     parser.add_argument("--skip", required=True, help="TXT file with accession number of genomes already downloaded")
     parser.add_argument("--metadata", required=True, help="Newly generated metadata file")
+    parser.add_argument("--email", required=False, default=Entrez.email, help="E-mail address sent to NCBI with each request")
+    parser.add_argument("--api-key", required=False, help="NCBI API key, allowing 10 instead of 3 requests per second")
+    parser.add_argument("--batch-size", required=False, type=int, default=200, help="Number of accessions fetched per request")
+    parser.add_argument("--threads", required=False, type=int, default=3, help="Number of concurrent requests to NCBI")
+    parser.add_argument("--history", required=False, action='store_true', help="Post accessions to the Entrez history server (epost), and fetch them from there")
+    parser.add_argument("--state", required=False, help="SQLite file with checkpoints of the download (default: <fasta>_download.sqlite)")
     args = parser.parse_args()
 
     ncbi_fasta = args.fasta
@@ -38,15 +50,42 @@ if __name__ == '__main__':
     # metadata = path + 'metadata_short.tsv'
 
 
+    # checkpoints of previous runs: drop anything written after the last one, before reading the files
+    state_file = args.state
+    if state_file == None:
+        state_file = os.path.splitext(ncbi_fasta)[0] + '_download.sqlite'
+    state = DownloadState(state_file, [ncbi_fasta, metadata, redundant])
+
     # existing ncbi fasta file
-    existing_ncbi = []
+    existing_ncbi = set()
     for fasta in SeqIO.parse(open(ncbi_fasta), 'fasta'):
         id = str(fasta.description).split('|')[1]
-        existing_ncbi.append(id)
-
-    dfN = pd.read_csv(metadata, encoding='utf-8', sep='\t', dtype=str)
-    # ns_entries = dfN['strain'].to_list()
-    dup_seqs = [accno.strip() for accno in open(redundant, 'r').readlines() if accno[0] not in ['\n', '#']]
+        existing_ncbi.add(id)
+
+    # strain -> GISAID accession, indexed once; new rows are buffered, and written at checkpoints
+    strain_epi = state.strain_index(metadata)
+    columns = pd.read_csv(metadata, encoding='utf-8', sep='\t', dtype=str, nrows=0).columns.to_list()
+
+    def metadata_line(row):
+        buffer = StringIO()
+        csv.writer(buffer, delimiter='\t', lineterminator=os.linesep).writerow([row.get(column, '') for column in columns])
+        return buffer.getvalue()
+    dup_seqs = set(accno.strip() for accno in open(redundant, 'r').readlines() if accno[0] not in ['\n', '#'])
+    if state.status:
+        print('Resuming download: ' + str(state.count('fetched')) + ' accessions fetched, ' + str(state.count('skipped')) +
+              ' skipped and ' + str(state.count('failed')) + ' failed in previous runs')
+
+    def processed(accno):
+        return accno in dup_seqs or accno in existing_ncbi or state.done(accno)
+
+    # GenBank records in batches of accessions, fetched by a few threads
+    fetcher = EntrezFetcher(args.email, api_key=args.api_key, batch_size=args.batch_size, workers=args.threads,
+                            history=args.history)
+    def parse_genbank(text):
+        # only accessions, references, source qualifiers and sequences are parsed; records without sequence are left out
+        for seq_record in genbank_stream.parse(text):
+            if seq_record.seq:
+                yield seq_record.id, seq_record
 
     inspect = Entrez.esearch(db="nucleotide", term="txid2697049[Organism] 25000:35000[SLEN]", idtype="acc")
     total_entries = int(Entrez.read(inspect)['Count'])
@@ -69,9 +108,7 @@ if __name__ == '__main__':
     notFound = []
     today = time.strftime('%Y-%m-%d', time.gmtime())
 
-    # export new NCBI entries
-    export_ncbi = open(ncbi_fasta, 'a')
-    new_redundants = open(redundant, 'a')
+    # export new NCBI entries: lines are staged, and written to files at each checkpoint
     comment = ''
 
     # print(dfN['gisaid_epi_isl'][dfN['strain'] == 'England/LIVE-9B50B/2020'].values[0])
@@ -88,19 +125,18 @@ if __name__ == '__main__':
             header = ['strain', 'virus', 'genbank_accession', 'date', 'country',
                       'division', 'location', 'segment', 'length', 'host', 'authors', 'date_submitted']
 
-            previous = 1
             count = 1
-            search_list = [accno.split('.')[0] for accno in record['IdList'] if accno.split('.')[0] not in dup_seqs + existing_ncbi]
-            excluded = [accno.split('.')[0] for accno in record['IdList'] if accno.split('.')[0] in dup_seqs + existing_ncbi]
+            search_list = [accno.split('.')[0] for accno in record['IdList'] if not processed(accno.split('.')[0])]
+            excluded = [accno.split('.')[0] for accno in record['IdList'] if processed(accno.split('.')[0])]
             c += len(excluded)
 
             print('A total of ' + str(len(excluded)) + ' genomes are listed in ' + redundant + ', and were not re-processed in this cycle.')
-            for accno in search_list:#[245:250]:
+            for accno, records in fetcher.records(search_list, parse_genbank):
                 # print(accno)
                 print('\n' + str(c) + '/' + str(total_entries))
 
                 # exporting accession numbers of processed GISAID-NCBI duplicates
-                if accno in dup_seqs + existing_ncbi:  # and strain in dfN['strain'].to_list():
+                if processed(accno):  # and strain in dfN['strain'].to_list():
                     print("\t- " + accno +  ': Genome already processed')
                 else:
                     accno = accno.split('.')[0]
@@ -109,18 +145,14 @@ if __name__ == '__main__':
                     for column_name in header:
                         new_row[column_name] = ''
 
-                    current = time.time()
-                    delay = 0.4
-                    elapsed = current - previous
-                    wait = delay - elapsed
-
                     try:
-                        handle = Entrez.efetch(db="nucleotide", id=accno, rettype="gb", retmode="text")
+                        if not records:  # missing from NCBI, or batch not retrieved
+                            raise LookupError(accno)
                         strain, virus, genbank_accession, date, country, division,\
                         location, segment, length, host, authors, date_submitted = ['' for x in header]
                         sequence = ''
                         isolate = ''
-                        for seq_record in SeqIO.parse(handle, "gb"):
+                        for seq_record in records:
                             sequence = str(seq_record.seq) # genome sequence
 
                             for feature in seq_record.annotations['references']:
@@ -187,54 +219,59 @@ if __name__ == '__main__':
                             c += 1
                             if comment == '':
                                 comment = '\n# Processed on ' + today + '\n'
-                                new_redundants.write(comment)
-                            new_redundants.write(accno + '\n')
-                            new_redundants. flush()
+                                state.stage(redundant, comment)
+                            state.stage(redundant, accno + '\n')
+                            state.mark(accno, 'skipped')
                             print('\t- ' + accno + ': Missing strain, country or date metadata. Skipping... ')
 
                             continue
 
                         ncbi_header = 'hCoV-19/' + strain + '|' + accno + '|' + date
-                        try:
-                            epi_isl = dfN['gisaid_epi_isl'][dfN['strain'] == strain].values[0]
-                        except:
-                            epi_isl = ''
+                        epi_isl = strain_epi.get(strain, '')
 
                         # # exporting accession numbers of processed GISAID-NCBI duplicates
                         # if accno in dup_seqs + existing_ncbi:# and strain in dfN['strain'].to_list():
                         #         print(str(c) + '/' + str(total_entries) + " - Sequence already processed: " + accno)
 
-                        # exporting new metadata lines
-                        if strain not in dfN['strain'].to_list():# and strain.replace('_', '-') not in dfN['strain'].to_list():
-                            dfG = pd.DataFrame(columns=dfN.columns.to_list())
-                            dfG = dfG.append(new_row, ignore_index=True)
-                            dfG.to_csv(metadata, sep='\t', index=False, header=False, mode='a')
+                        # exporting new metadata lines; strains are matched against the metadata as it was when
+                        # the run started, so every accession of a strain first seen in this run is exported
+                        if strain not in strain_epi:# and strain.replace('_', '-') not in strain_epi:
+                            state.stage(metadata, metadata_line(new_row))
+                            state.add_strain(strain, '')
+                            state.mark(accno, 'fetched')
 
                             # print(list(dfN.loc[dfN['strain'] == strain].values))
                             print("\t- Exporting NCBI metadata: " + ncbi_header)
 
                             # exporting new NCBI sequences
                             if accno not in existing_ncbi and epi_isl in ['?', '', np.nan]:
-                                export_ncbi.write('>' + ncbi_header + '\n' + sequence + '\n')
-                                export_ncbi.flush()
-                                existing_ncbi.append(accno)
+                                state.stage(ncbi_fasta, '>' + ncbi_header + '\n' + sequence + '\n')
+                                existing_ncbi.add(accno)
                                 print('\t- Exporting NCBI fasta: ' + ncbi_header)
 
                         else:
                             # if not epi_isl in ['?', '', np.nan] and accno not in dup_seqs:
                             if comment == '':
                                 comment = '\n# Processed on ' + today + '\n'
-                                new_redundants.write(comment)
-                            new_redundants.write(accno + '\n')
-                            new_redundants.flush()
+                                state.stage(redundant, comment)
+                            state.stage(redundant, accno + '\n')
+                            state.mark(accno, 'skipped')
                             print('\t- ' + accno+ ': GISAID entry. Skipping... ')
                     except:
                         print("\t- " + accno + ": entry not found on NCBI.")
                         notFound.append(accno)
-                    previous = time.time()
+                        state.mark(accno, 'failed')
                     count += 1
                     c += 1
 
+                    if state.pending() >= args.batch_size:
+                        state.checkpoint()
+            state.checkpoint()
+
+    # the download is complete: files alone tell which accessions were processed
+    state.clear()
+    state.close()
+
     # list entries not found on NCBI
     if len(notFound) > 0:
         print('\nThe following genomes were not retrieved:\n')
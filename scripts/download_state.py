@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Checkpoints of sequence downloads, stored in SQLite
+
+Accessions are recorded as fetched, skipped or failed. Text destined to output
+files (FASTA, metadata, list of skipped accessions) is staged in memory, and
+written at each checkpoint, after which the sizes of the files and the status of
+the accessions are committed in a single transaction. When a run is interrupted,
+the next one removes anything written after the last checkpoint, so files never
+keep partial records, and resumes with the accessions not processed yet.
+Statuses and checkpoints are only kept until the download completes, so files
+extended by other means after a complete run are left as they are; statuses are
+also discarded if the files no longer match their last checkpoint.
+
+The state also keeps an index of strain names and GISAID accessions of the
+metadata, rebuilt only when the metadata file was changed by other means, and
+extended with the rows appended at each checkpoint.
+"""
+
+import pandas as pd
+import hashlib
+import sqlite3
+import time
+import os
+
+TAIL = 1024  # bytes before the checkpoint used to recognize a file
+
+
+def _tail_digest(path, size):
+    with open(path, 'rb') as infile:
+        infile.seek(max(0, size - TAIL))
+        return hashlib.sha1(infile.read(min(size, TAIL))).hexdigest()
+
+
+class DownloadState:
+    ''' Status of accessions and sizes of output files, at the last checkpoint '''
+    def __init__(self, path, files):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS accessions (accno TEXT PRIMARY KEY, status TEXT, updated REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, tail TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS strains (strain TEXT PRIMARY KEY, gisaid_epi_isl TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS indexed (path TEXT PRIMARY KEY, size INTEGER, tail TEXT)')
+        self.db.commit()
+        self.files = [os.path.abspath(path) for path in files]
+        self.staged = {path: [] for path in self.files}
+        self.statuses = {}
+        self.indexed = None  # metadata file whose strains are indexed
+        self.new_strains = {}
+        self.status = dict(self.db.execute('SELECT accno, status FROM accessions'))
+        self.restore()
+        self.checkpoint()
+
+    def restore(self):
+        ''' Truncate files that grew after the last checkpoint of an interrupted run, if they are otherwise
+        unchanged. If any file was changed by other means, statuses of the previous runs are no longer trusted '''
+        changed = []
+        for path in self.files:
+            row = self.db.execute('SELECT size, tail FROM files WHERE path = ?', (path,)).fetchone()
+            if row is None:
+                continue
+            size, tail = row
+            current = os.path.getsize(path) if os.path.exists(path) else -1
+            if current < size or _tail_digest(path, size) != tail:
+                changed.append(path)
+            elif current > size:
+                print('Removing ' + str(current - size) + ' bytes written to ' + path + ' after the last checkpoint')
+                with open(path, 'r+b') as outfile:
+                    outfile.truncate(size)
+
+        if changed and self.status:
+            print('Files changed since the last checkpoint (' + ', '.join(changed) + '): statuses of previous runs are discarded')
+            self.clear()
+
+    def clear(self):
+        ''' Forget the status of all accessions and the checkpoints of files, e.g. once a download is complete '''
+        with self.db:
+            self.db.execute('DELETE FROM accessions')
+            self.db.execute('DELETE FROM files')
+        self.status = {}
+        self.statuses = {}
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def strain_index(self, metadata):
+        ''' {strain: GISAID accession} of the metadata, read from the file only if it changed since it was last indexed '''
+        path = os.path.abspath(metadata)
+        size = os.path.getsize(path)
+        row = self.db.execute('SELECT size, tail FROM indexed WHERE path = ?', (path,)).fetchone()
+        self.indexed = path
+        if row is not None and row == (size, _tail_digest(path, size)):
+            return dict(self.db.execute('SELECT strain, gisaid_epi_isl FROM strains'))
+
+        print('Indexing strain names of ' + metadata)
+        # GISAID accessions are read only if the metadata has them
+        dfI = pd.read_csv(metadata, encoding='utf-8', sep='\t', dtype=str, usecols=lambda column: column in ('strain', 'gisaid_epi_isl'))
+        dfI = dfI[dfI['strain'].notna()].drop_duplicates(subset='strain')  # first row of each strain
+        epi_isl = dfI['gisaid_epi_isl'].fillna('') if 'gisaid_epi_isl' in dfI.columns else [''] * len(dfI)
+        index = dict(zip(dfI['strain'], epi_isl))
+        with self.db:
+            self.db.execute('DELETE FROM strains')
+            self.db.execute('DELETE FROM indexed')
+            self.db.executemany('INSERT INTO strains VALUES (?, ?)', index.items())
+            self.db.execute('INSERT INTO indexed VALUES (?, ?, ?)', (path, size, _tail_digest(path, size)))
+        return index
+
+    def add_strain(self, strain, epi_isl):
+        ''' Index a strain of a metadata row staged for the next checkpoint '''
+        self.new_strains[strain] = epi_isl
+
+    def done(self, accno):
+        ''' Accessions fetched or skipped in previous runs; failed ones are tried again '''
+        return self.status.get(accno) in ('fetched', 'skipped')
+
+    def count(self, status):
+        return sum(1 for value in self.status.values() if value == status)
+
+    def stage(self, path, text):
+        self.staged[os.path.abspath(path)].append(text)
+
+    def mark(self, accno, status):
+        self.statuses[accno] = status
+        self.status[accno] = status
+
+    def pending(self):
+        return len(self.statuses)
+
+    def checkpoint(self):
+        ''' Write staged text to files, and commit their sizes along with the status of accessions '''
+        sizes = []
+        for path in self.files:
+            if self.staged[path]:
+                with open(path, 'a') as outfile:
+                    outfile.write(''.join(self.staged[path]))
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+                self.staged[path] = []
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                sizes.append((path, size, _tail_digest(path, size)))
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', sizes)
+            self.db.executemany('INSERT OR REPLACE INTO accessions VALUES (?, ?, ?)',
+                                [(accno, status, now) for accno, status in self.statuses.items()])
+            if self.indexed is not None:
+                self.db.executemany('INSERT OR IGNORE INTO strains VALUES (?, ?)', self.new_strains.items())
+                self.db.executemany('UPDATE indexed SET size = ?, tail = ? WHERE path = ?',
+                                    [(size, tail, path) for path, size, tail in sizes if path == self.indexed])
+        self.statuses = {}
+        self.new_strains = {}
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Batched and concurrent retrieval of GenBank records from NCBI Entrez
+
+Accessions are fetched in batches (comma-separated IDs in a single efetch call),
+or posted once to the Entrez history server (epost), and then fetched in slices
+of the posted list (WebEnv and query_key). A few worker threads share a token
+bucket that keeps requests within the limits of NCBI: 3 per second, or 10 per
+second with an API key. Failed requests are retried with exponential backoff.
+Batches are returned in order, so outputs do not depend on timing.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import random
+import time
+
+
+class TokenBucket:
+    ''' Allow up to rate calls per second on average, in bursts of up to capacity calls, from any number of threads '''
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class EntrezFetcher:
+    ''' Fetch GenBank records of accessions in batches, with rate-limited worker threads '''
+    def __init__(self, email, api_key=None, batch_size=200, workers=3, rate=None, retries=3, history=False):
+        from Bio import Entrez
+        self.entrez = Entrez
+        Entrez.email = email
+        if api_key:
+            Entrez.api_key = api_key
+        if rate is None:
+            rate = 10 if api_key else 3
+        self.bucket = TokenBucket(rate)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.history = history
+
+    # errors (e.g. HTTP 429 or 5xx, timeouts, truncated replies) are retried after 1, 2, 4... seconds, plus jitter
+    def _request(self, call, **params):
+        for attempt in range(self.retries + 1):
+            self.bucket.wait()
+            try:
+                handle = call(**params)
+                try:
+                    return handle.read()
+                finally:
+                    handle.close()
+            except Exception as error:
+                if attempt == self.retries:
+                    raise
+                print('\t* Entrez request failed (' + str(error) + '), retrying...')
+                time.sleep(2 ** attempt + random.random())
+
+    def post(self, accessions):
+        ''' Post accessions to the Entrez history server, returning (WebEnv, query_key) '''
+        reply = self._request(self.entrez.epost, db='nucleotide', id=','.join(accessions))
+        record = self.entrez.read(_text_handle(reply))
+        return record['WebEnv'], record['QueryKey']
+
+    def fetch_text(self, batch, history=None, retstart=0):
+        ''' GenBank text of a batch of accessions, fetched by ID, or as a slice of a posted list '''
+        params = {'db': 'nucleotide', 'rettype': 'gb', 'retmode': 'text'}
+        if history is None:
+            params['id'] = ','.join(batch)
+        else:
+            params.update({'webenv': history[0], 'query_key': history[1], 'retstart': retstart, 'retmax': len(batch)})
+        reply = self._request(self.entrez.efetch, **params)
+        return reply.decode('utf-8') if isinstance(reply, bytes) else reply
+
+    def batches(self, accessions, history=False):
+        ''' Yield (batch, GenBank text) for consecutive batches of accessions, or (batch, None) if a batch failed.
+        With history, batches are slices of the posted list, and may hold records of other accessions of the list '''
+        accessions = list(accessions)
+        batches = [accessions[start:start + self.batch_size] for start in range(0, len(accessions), self.batch_size)]
+        if not batches:
+            return
+
+        posted = None
+        if history:
+            try:
+                posted = self.post(accessions)
+            except Exception as error:
+                print('\t* WARNING! epost failed (' + str(error) + '), fetching accessions by ID')
+
+        def fetch(number):
+            try:
+                return self.fetch_text(batches[number], posted, number * self.batch_size)
+            except Exception as error:
+                print('\t* WARNING! Batch of ' + str(len(batches[number])) + ' accessions could not be fetched (' + str(error) + ')')
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for batch, text in zip(batches, pool.map(fetch, range(len(batches)))):
+                yield batch, text
+
+    def records(self, accessions, parse):
+        ''' Yield (accession, records) for each accession (without version), where parse(text) yields (accession, record).
+        Records are an empty list for accessions missing from NCBI, or None for accessions that could not be fetched '''
+        accessions = list(dict.fromkeys(accno.split('.')[0] for accno in accessions))
+        pending = set(accessions)
+
+        def found_in(text):
+            found = {}
+            for accno, record in parse(text):
+                accno = accno.split('.')[0]
+                if accno in pending:
+                    found.setdefault(accno, []).append(record)
+            return found
+
+        if self.history:
+            # records of posted lists come in the order of the history server: collect them as they come
+            failed = False
+            for batch, text in self.batches(accessions, history=True):
+                if text is None:
+                    failed = True
+                    continue
+                for accno, records in found_in(text).items():
+                    pending.discard(accno)
+                    yield accno, records
+            if not failed:
+                for accno in accessions:
+                    if accno in pending:
+                        yield accno, []
+                return
+            # slices that failed hold unknown accessions: fetch all the ones still missing by ID
+            accessions = [accno for accno in accessions if accno in pending]
+
+        for batch, text in self.batches(accessions):
+            found = found_in(text) if text is not None else {}
+            for accno in batch:
+                pending.discard(accno)
+                yield accno, (found.get(accno, []) if text is not None else None)
+
+
+def _text_handle(reply):
+    from io import BytesIO, StringIO
+    return BytesIO(reply) if isinstance(reply, bytes) else StringIO(reply)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Date parsing and CDC epiweek lookups for metadata columns
+
+Metadata files have millions of rows but only a few hundred distinct dates, so
+each distinct value is parsed once, and results are mapped back to the column.
+Dates with missing fields (e.g. '2021-03-XX', '2021-XX-XX') are not parsed, and
+give NaT or an empty epiweek; use is_full_date to keep only complete dates.
+"""
+
+from epiweeks import Week
+import pandas as pd
+
+
+# build a lookup table over distinct values, and map it back to the column
+def lookup(series, function):
+    return series.map({value: function(value) for value in pd.unique(series)})
+
+
+def is_full_date(dates):
+    ''' Boolean mask of YYYY-MM-DD strings, without missing (X) fields '''
+    dates = dates.astype(str)
+    return (dates.str.count('-') == 2) & ~dates.str.contains('X', regex=False)
+
+
+def _parse(date):
+    if isinstance(date, str) and (date == '' or 'X' in date):
+        return pd.NaT
+    try:
+        return pd.to_datetime(date)
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+
+
+def parse_dates(dates):
+    ''' Parse a column of date strings, with NaT for missing, partial or invalid dates '''
+    return pd.to_datetime(lookup(dates, _parse))
+
+
+def _epiweek(date):
+    date = _parse(date)
+    if pd.isna(date):
+        return None
+    return Week.fromdate(date, system="cdc")
+
+
+def epiweek_labels(dates):
+    ''' Epiweeks as 'YYYY_EWww' strings, empty for dates that cannot be parsed '''
+    def label(date):
+        week = _epiweek(date)
+        if week is None:
+            return ''
+        week = str(week)
+        return week[:4] + '_' + 'EW' + week[-2:]
+    return lookup(dates, label)
+
+
+def epiweek_enddates(dates):
+    ''' Last day (datetime.date) of the epiweek of each date, None for dates that cannot be parsed '''
+    def enddate(date):
+        week = _epiweek(date)
+        return None if week is None else week.enddate()
+    return lookup(dates, enddate)
@@ -6,13 +6,12 @@
 # Last update: 2021-08-10
 
 
-import pycountry_convert as pyCountry
-import pycountry
 from Bio import SeqIO
 import pandas as pd
-from epiweeks import Week
 import time
 import argparse
+from epiweek_dates import parse_dates, epiweek_labels
+from iso_codes import iso_codes
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -235,33 +234,6 @@ if __name__ == '__main__':
                 }
 
 
-    # get ISO alpha3 country codes
-
-    isos =  {'US Virgin Islands':'VIR','Virgin Islands':'VIR','British Virgin Islands':'VGB','Curacao':'CUW','Northern Mariana Islands':'MNP',
-            'Sint Maarten':'MAF','St Eustatius':'BES'}
-    def get_iso(country):
-        global isos
-        if country not in isos.keys():
-            try:
-                isoCode = pyCountry.country_name_to_country_alpha3(country, cn_name_format="default")
-                isos[country] = isoCode
-            except:
-                try:
-                    isoCode = pycountry.countries.search_fuzzy(country)[0].alpha_3
-                    isos[country] = isoCode
-                except:
-                    isos[country] = ''
-        return isos[country]
-
-
-    # create epiweek column
-    def get_epiweeks(date):
-        date = pd.to_datetime(date)
-        epiweek = str(Week.fromdate(date, system="cdc"))  # get epiweeks
-        epiweek = epiweek[:4] + '_' + 'EW' + epiweek[-2:]
-        return epiweek
-
-
     # add state code
     us_state_abbrev = {
         'Alabama': 'AL',
@@ -331,14 +303,10 @@ if __name__ == '__main__':
     dfN.fillna('', inplace=True)
 
     # add tag of variant category
-    def variant_category(lineage):
-        var_category = 'Other variants'
-        for name in variants.keys():
-            if lineage == name:
-                var_category = variants[lineage]
-        return var_category
+    def variant_category(lineages):
+        return lineages.map(variants).fillna('Other variants')
 
-    dfN['category'] = dfN['pango_lineage'].apply(lambda x: variant_category(x))
+    dfN['category'] = variant_category(dfN['pango_lineage'])
 
 
     list_columns = dfN.columns.values  # list of column in the original metadata file
@@ -370,8 +338,8 @@ if __name__ == '__main__':
         dfL = pd.concat([dfL, dfF]) # add filtered rows to dataframe with lab metadata
 
     # list of relevant genomes sequenced
-    keep_only = dfL['id'].tolist()
-    excluded = [id for id in lab_sequences if id not in keep_only]
+    keep_only = set(dfL['id'].tolist())
+    excluded = set(id for id in lab_sequences if id not in keep_only)
 
     # create a dict of existing sequences
     sequences = {}
@@ -385,133 +353,81 @@ if __name__ == '__main__':
         if col not in dfL.columns:
             dfL[col] = ''
 
-    # output dataframe
-    outputDF = pd.DataFrame(columns=list_columns)
-    found = []
-    lab_label = {}
+    # ISO codes, dates and epiweeks are resolved once per distinct country and date
+    # process metadata from excel sheet, column-wise
+    dfL = dfL.reset_index(drop=True)
+    ids = dfL['id'].astype(str).str.replace('hCoV-19/', '', regex=False)
+    dfL = dfL[ids.isin(sequences.keys())]
+    ids = ids[dfL.index]
+    dfR = dfL[list_columns].apply(lambda column: column.astype(str).str.strip())  # stripped values
+
+    # check for missing geodata
+    missing_country = dfR['country'].str.len() < 1
+
+    dfR['location'] = dfR['location'].where(dfR['location'] != '', dfL['location'])
+
+    # check is date is appropriate: not missing, not from the 'future', not older than 'min_date'
+    has_date = (dfR['date'].str.len() > 1) & ~dfR['date'].str.contains('X', regex=False)
+    collection_date = dfR['date'].str.split(' ').str[0].str.replace('.', '-', regex=False).str.replace('/', '-', regex=False)
+    collection_date = collection_date.where(has_date, '')
+    dfR['date'] = dfR['date'].where(~has_date, collection_date)
+    parsed = parse_dates(collection_date)
+    bad_date = ~has_date | parsed.isna() | (parsed > pd.to_datetime(today)) | (parsed < pd.to_datetime(min_date))
+
+    # record issues per sample, and drop rows of samples with issues (from that row onwards)
     metadata_issues = {}
-    # process metadata from excel sheet
-    for idx, row in dfL.iterrows():
-        id = dfL.loc[idx, 'id'].replace('hCoV-19/', '')
-        if id in sequences:
-            dict_row = {}
-            for col in list_columns:
-                dict_row[col] = ''
-                if col in row:
-                    dict_row[col] = dfL.loc[idx, col].strip()  # add values to dictionary
-
-            # check for missing geodata
-            geodata = ['country'] # column
-            for level in geodata:
-                if len(dict_row[level]) < 1:
-                    if id not in metadata_issues:
-                        metadata_issues[id] = [level]
-                    else:
-                        metadata_issues[id].append(level)
-
-            if dict_row['location'] in ['', None]:
-                dict_row['location'] = dfL.loc[idx, 'location']
-
-            collection_date = ''
-            if len(str(dict_row['date'])) > 1 and 'X' not in dict_row['date']:
-                collection_date = dict_row['date'].split(' ')[0].replace('.', '-').replace('/', '-')
-                dict_row['date'] = collection_date
-                # check is date is appropriate: not from the 'future', not older than 'min_date'
-                if pd.to_datetime(today) < pd.to_datetime(collection_date) or pd.to_datetime(min_date) > pd.to_datetime(collection_date):
-                    if id not in metadata_issues:
-                        metadata_issues[id] = ['date']
-                    else:
-                        metadata_issues[id].append('date')
-            else: # missing date
-                if id not in metadata_issues:
-                    metadata_issues[id] = ['date']
-                else:
-                    metadata_issues[id].append('date')
-
-            # fix exposure
-            columns_exposure = ['country_exposure', 'division_exposure']
-            for level_exposure in columns_exposure:
-                level = level_exposure.split('_')[0]
-                dict_row[level_exposure] = dfL.loc[idx, level_exposure]
-                if dict_row[level_exposure] in ['', None]:
-                    if level_exposure == 'country_exposure':
-                        dict_row[level_exposure] = dict_row[level]
-                    else:
-                        if dict_row['country_exposure'] != dfL.loc[idx, 'country']:
-                            dict_row[level_exposure] = dict_row['country_exposure']
-                        else:
-                            dict_row[level_exposure] = dict_row[level]
-
-            code = ''
-            if dict_row['division'] in us_state_abbrev:
-                code = us_state_abbrev[dict_row['division']] + '-'
-
-            strain = dfL.loc[idx, 'country'].replace(' ', '') + '/' + code + dfL.loc[idx, 'id'] + '/' + collection_date.split('-')[0]
-
-            # set the strain name
-            dict_row['strain'] = strain
-            dict_row['iso'] = get_iso(dict_row['country'])
-            dict_row['originating_lab'] = dfL.loc[idx, 'originating_lab']
-            dict_row['submitting_lab'] = 'Grubaugh Lab - Yale School of Public Health'
-            dict_row['authors'] = 'GLab team'
-
-            # add lineage
-            lineage = ''
-            if dfL.loc[idx, 'pango_lineage'] != '':
-                lineage = dfL.loc[idx, 'pango_lineage']
-            dict_row['pango_lineage'] = lineage
-
-            # variant classication (VOI, VOC, VHC)
-            dict_row['category'] = variant_category(lineage)
-
-            # assign epiweek
-            if len(dict_row['date']) > 0 and 'X' not in dict_row['date']:
-                dict_row['epiweek'] = get_epiweeks(collection_date)
-            else:
-                dict_row['epiweek'] = ''
-
-            # record sequence and metadata as found
-            found.append(strain)
-            if id not in metadata_issues.keys():
-                lab_label[id] = strain
-                outputDF = outputDF.append(dict_row, ignore_index=True)
-
-
-    # process metadata from TSV
+    for id, country_issue, date_issue in zip(ids[missing_country | bad_date], missing_country[missing_country | bad_date],
+                                             bad_date[missing_country | bad_date]):
+        metadata_issues.setdefault(id, [])
+        metadata_issues[id] += ['country'] * int(country_issue) + ['date'] * int(date_issue)
+    keep_row = (missing_country | bad_date).astype(int).groupby(ids).cummax() == 0
+
+    # fix exposure
+    country_exposure = dfL['country_exposure'].where(dfL['country_exposure'] != '', dfR['country'])
+    dfR['division_exposure'] = dfL['division_exposure'].where(dfL['division_exposure'] != '',
+                                                              country_exposure.where(country_exposure != dfL['country'], dfR['division']))
+    dfR['country_exposure'] = country_exposure
+
+    # set the strain name
+    code = (dfR['division'].map(us_state_abbrev) + '-').fillna('')
+    dfR['strain'] = dfL['country'].str.replace(' ', '', regex=False) + '/' + code + dfL['id'] + '/' + collection_date.str.split('-').str[0]
+    dfR['iso'] = iso_codes(dfR['country'])
+    dfR['originating_lab'] = dfL['originating_lab']
+    dfR['submitting_lab'] = 'Grubaugh Lab - Yale School of Public Health'
+    dfR['authors'] = 'GLab team'
+
+    # add lineage, and variant classication (VOI, VOC, VHC)
+    dfR['pango_lineage'] = dfL['pango_lineage']
+    dfR['category'] = variant_category(dfR['pango_lineage'])
+
+    # assign epiweek
+    dfR['epiweek'] = epiweek_labels(collection_date.where(keep_row, ''))
+
+    dfR = dfR[keep_row]
+    lab_label = dict(zip(ids[keep_row], dfR['strain']))
+
+    # process metadata from TSV, skipping strains already found in lab metadata
     dfN = dfN[dfN['strain'].isin(sequences.keys())]
-    for idx, row in dfN.iterrows():
-        strain = dfN.loc[idx, 'strain'].replace('hCoV-19/', '')
-        if strain in sequences:
-            if strain in outputDF['strain'].to_list():
-                continue
-            dict_row = {}
-            date = ''
-            for col in list_columns:
-                if col == 'date':
-                    date = dfN.loc[idx, col]
-                dict_row[col] = ''
-                if col in row:
-                    dict_row[col] = dfN.loc[idx, col]
-
-            # fix exposure
-            columns_exposure = ['country_exposure', 'division_exposure']
-            for level_exposure in columns_exposure:
-                level = level_exposure.split('_')[0]
-                if dict_row[level_exposure] in ['', None]:
-                    dict_row[level_exposure] = dict_row[level]
-
-            dict_row['iso'] = get_iso(dict_row['country'])
-            dict_row['epiweek'] = get_epiweeks(date)
-            found.append(strain)
-
-            outputDF = outputDF.append(dict_row, ignore_index=True)
+    dfN = dfN[~dfN['strain'].isin(set(dfR['strain']))].drop_duplicates(subset=['strain'])
+    dfN = dfN[list_columns].copy()
+
+    # fix exposure
+    for level_exposure in ['country_exposure', 'division_exposure']:
+        level = level_exposure.split('_')[0]
+        dfN[level_exposure] = dfN[level_exposure].where(dfN[level_exposure] != '', dfN[level])
+
+    dfN['iso'] = iso_codes(dfN['country'])
+    dfN['epiweek'] = epiweek_labels(dfN['date'])
 
     # write new metadata files
+    output_columns = list(list_columns) + [col for col in ['epiweek'] if col not in list_columns]
+    outputDF = pd.concat([dfR, dfN], ignore_index=True)[output_columns]
     outputDF = outputDF.drop(columns=['region'])
     outputDF.to_csv(output1, sep='\t', index=False)
 
     # write sequence file
-    exported = []
+    exported = set()
+    output_strains = set(outputDF['strain'])
     with open(output2, 'w') as outfile2:
         # export new metadata lines
         for id, sequence in sequences.items():
@@ -520,12 +436,12 @@ if __name__ == '__main__':
                     entry = '>' + lab_label[id] + '\n' + sequence + '\n'
                     outfile2.write(entry)
                     print('* Exporting newly sequenced genome and metadata for ' + id)
-                    exported.append(lab_label[id])
+                    exported.add(lab_label[id])
             else:  # export publicly available sequences
-                if id not in exported and id in outputDF['strain'].tolist():
+                if id not in exported and id in output_strains:
                     entry = '>' + id + '\n' + sequence + '\n'
                     outfile2.write(entry)
-                    exported.append(id)
+                    exported.add(id)
 
     if len(metadata_issues) > 0:
         print('\n\n### WARNINGS!\n')
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Streaming parser of GenBank flat files, extracting only what the builds use
+
+Entries are read in blocks of text, keeping their accession, references (authors and
+journal), the qualifiers of 'source' features and the sequence. Other features
+are skipped without being parsed, and no SeqFeature or Seq objects are built.
+Records mimic the attributes of Bio.SeqIO records used by download_sequences.py
+(id, seq, annotations['references'], features), with values as Bio.SeqIO would
+parse them: continuation lines joined by spaces, and sequences in upper case.
+"""
+
+from io import StringIO
+import argparse
+import re
+import time
+
+
+class Reference:
+    def __init__(self):
+        self.authors = ''
+        self.title = ''
+        self.journal = ''
+
+
+class SourceFeature:
+    type = 'source'
+
+    def __init__(self):
+        self.qualifiers = {}
+
+
+class GenBankRecord:
+    def __init__(self):
+        self.id = ''
+        self.name = ''
+        self.seq = ''
+        self.annotations = {'references': []}
+        self.features = []
+
+
+# characters of sequence lines that are not bases: positions, spaces and line breaks
+NOT_BASES = str.maketrans('', '', '0123456789 \t\r\n')
+
+# lines starting a feature, and the first line after the feature table
+FEATURE_START = re.compile(r'\n {5}\S')
+TABLE_END = re.compile(r'\n[^ ]')
+
+# reference fields kept, as named by GenBank and by Bio.SeqFeature.Reference
+REFERENCE_FIELDS = {'AUTHORS': 'authors', 'TITLE': 'title', 'JOURNAL': 'journal'}
+
+
+def _add_qualifier(feature, qualifier):
+    key, _, value = qualifier.partition('=')
+    if value.startswith('"'):
+        value = value[1:-1] if value.endswith('"') and len(value) > 1 else value[1:]
+        value = value.replace('""', '"')
+    feature.qualifiers.setdefault(key, []).append(value)
+
+
+def _source_feature(block):
+    ''' Qualifiers of a source feature, from its lines in the feature table '''
+    source = SourceFeature()
+    qualifier = None
+    for line in block.split('\n')[1:]:
+        text = line[21:].rstrip()
+        if not text:
+            continue
+        # a line starting with '/' is a new qualifier, unless the value of the current one is still quoted
+        if text.startswith('/') and (qualifier is None or qualifier.count('"') % 2 == 0):
+            if qualifier is not None:
+                _add_qualifier(source, qualifier)
+            qualifier = text[1:]
+        elif qualifier is not None:
+            qualifier += ' ' + text
+    if qualifier is not None:
+        _add_qualifier(source, qualifier)
+    return source
+
+
+def parse_record(text):
+    ''' Record from the text of a GenBank entry, from its LOCUS line up to (not including) its // line '''
+    record = GenBankRecord()
+
+    # sequence: everything after the ORIGIN line, without positions and spaces
+    origin = text.find('\nORIGIN')
+    if origin >= 0:
+        start = text.find('\n', origin + 1)
+        record.seq = text[start:].translate(NOT_BASES).upper() if start >= 0 else ''
+        text = text[:origin + 1]
+
+    # feature table: only source features are parsed, other ones are skipped
+    features = text.find('\nFEATURES')
+    if features >= 0:
+        start = text.find('\n', features + 1)
+        end = TABLE_END.search(text, start if start >= 0 else len(text))
+        end = end.start() + 1 if end else len(text)
+        table = text[start:end]
+        begin = table.find('\n     source ')
+        while begin >= 0:
+            finish = FEATURE_START.search(table, begin + 1)
+            finish = finish.start() if finish else len(table)
+            record.features.append(_source_feature(table[begin + 1:finish]))
+            begin = table.find('\n     source ', finish)
+        text = text[:features + 1] + text[end:]
+
+    # header: name, accession and references
+    reference, field = None, None  # reference being read, and its current field
+    for line in text.split('\n'):
+        if line.startswith('LOCUS'):
+            record.name = line.split()[1] if len(line.split()) > 1 else ''
+        elif line.startswith('ACCESSION'):
+            if not record.id:
+                record.id = line.split()[1] if len(line.split()) > 1 else ''
+        elif line.startswith('VERSION'):
+            if len(line.split()) > 1:
+                record.id = line.split()[1]
+        elif line.startswith('REFERENCE'):
+            reference, field = Reference(), None
+            record.annotations['references'].append(reference)
+        elif reference is not None and line.startswith('  ') and line[2] != ' ':
+            # fields of references are indented by two spaces, and continued by twelve
+            field = REFERENCE_FIELDS.get(line[:12].strip())
+            if field is not None:
+                setattr(reference, field, line[12:].strip())
+        elif reference is not None and line.startswith('            '):
+            if field is not None:
+                setattr(reference, field, getattr(reference, field) + ' ' + line.strip())
+        elif not line.startswith(' '):
+            reference, field = None, None
+    return record
+
+
+def parse(handle, block_size=1 << 20):
+    ''' Yield records of a GenBank file (handle or text), reading it in blocks; entries missing their // line are ignored '''
+    if isinstance(handle, str):
+        handle = StringIO(handle)
+
+    buffer = ''
+    while True:
+        block = handle.read(block_size)
+        buffer += block
+        # entries end with a line starting with //, and the last piece may be incomplete
+        pieces = buffer.split('\n//')
+        buffer = pieces.pop() if block else ''
+        for piece in pieces:
+            start = piece.find('LOCUS')
+            if start >= 0:
+                yield parse_record(piece[start:] + '\n')
+        if not block:
+            break
+
+
+def benchmark(path, repeats=1):
+    ''' Compare speed and extracted values of this parser and Bio.SeqIO on a GenBank file '''
+    from Bio import SeqIO
+
+    def summary(record):
+        source = [dict((key, value) for key, value in feature.qualifiers.items()
+                       if key in ('collection_date', 'country', 'isolate', 'host'))
+                  for feature in record.features if feature.type == 'source']
+        references = [(reference.authors, reference.journal) for reference in record.annotations['references']]
+        return record.id, str(record.seq), source, references
+
+    timings = {}
+    results = {}
+    for name, parser in [('Bio.SeqIO', lambda infile: SeqIO.parse(infile, 'gb')), ('genbank_stream', parse)]:
+        start = time.time()
+        for round in range(repeats):
+            with open(path) as infile:
+                results[name] = [summary(record) for record in parser(infile)]
+        timings[name] = (time.time() - start) / repeats
+        print(name + ': ' + str(len(results[name])) + ' records in ' + '%.2f' % timings[name] + ' seconds')
+
+    same = results['Bio.SeqIO'] == results['genbank_stream']
+    print('Speedup: ' + '%.1f' % (timings['Bio.SeqIO'] / timings['genbank_stream']) + 'x; ' +
+          ('identical' if same else 'DIFFERENT') + ' accessions, sequences, source qualifiers and references')
+    return same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the streaming GenBank parser against Bio.SeqIO",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--genbank", required=True, help="GenBank file with one or more records")
+    parser.add_argument("--repeats", required=False, type=int, default=1, help="Number of times each parser reads the file")
+    args = parser.parse_args()
+
+    benchmark(args.genbank, args.repeats)
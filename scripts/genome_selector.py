@@ -8,7 +8,8 @@
 
 import pandas as pd
 import numpy as np
-from epiweeks import Week
+from epiweek_dates import is_full_date, parse_dates, epiweek_enddates
+from stratified_sampling import StratifiedSampler, category_key, scheme_digest, scheme_seed, read_manifest, write_manifest
 import time
 import argparse
 
@@ -22,6 +23,11 @@ if __name__ == '__main__':
     parser.add_argument("--remove", required=False, help="List of samples to remove, in all instances")
     parser.add_argument("--scheme", required=True, help="Subsampling scheme")
     parser.add_argument("--report", required=False, help="Report listing samples per category")
+    parser.add_argument("--seed", required=False, type=int, default=0, help="Seed of the selection, combined with the checksum of the scheme")
+    parser.add_argument("--manifest", required=False, help="TSV listing the scheme row that selected each genome")
+    parser.add_argument("--cores", required=False, type=int, default=1, help="Number of processes matching rows of the scheme")
+    parser.add_argument("--previous", required=False, help="Manifest of a previous selection (see --manifest), whose genomes are kept, resampling only epiweeks whose pool or quota changed")
+    parser.add_argument("--delta", required=False, help="TSV listing genomes added and dropped since the previous selection (requires --previous)")
     args = parser.parse_args()
 
     metadata = args.metadata
@@ -29,7 +35,9 @@ if __name__ == '__main__':
     remove = args.remove
     scheme = args.scheme
     report = args.report
-
+    manifest = args.manifest
+    previous_manifest = args.previous
+    delta = args.delta
 
 
     # path = '/Users/anderson/GLab Dropbox/Anderson Brito/projects/ncov/ncov_pango/nextstrain/run3_20210721_B1526newaugur/'
@@ -73,12 +81,10 @@ if __name__ == '__main__':
     dfN['strain'] = dfN['strain'].str.replace('hCoV-19/', '', regex=False)
 
 
-    # print(dfN['strain'].tolist())
-    name_accno = {}
-    for genome in to_keep:
-        if genome in dfN['strain'].tolist():
-            accno = dfN.loc[dfN['strain'] == genome, 'gisaid_epi_isl'].values[0]
-            name_accno[genome] = accno
+    # accession numbers of genomes listed in keep.txt, from a strain -> accession map built once
+    strain_accno = dict(zip(dfN['strain'].values[::-1], dfN['gisaid_epi_isl'].values[::-1]))  # first row of each strain
+    name_accno = {genome: strain_accno[genome] for genome in to_keep if genome in strain_accno}
+    del strain_accno
 
     # drop lines if samples are set to be ignored
     for column, names in ignore.items():
@@ -97,26 +103,34 @@ if __name__ == '__main__':
 
     print('\n* Dropping sequences with incomplete date...')
     # drop rows with incomplete dates
-    dfN = dfN[dfN['date'].apply(lambda x: len(x.split('-')) == 3)] # accept only full dates
-    dfN = dfN[dfN['date'].apply(lambda x: 'X' not in x)] # exclude -XX-XX missing dates
+    dfN = dfN[is_full_date(dfN['date'])] # accept only full dates, excluding -XX-XX missing dates
 
-    # convert string dates into date format
-    dfN['date'] = pd.to_datetime(dfN['date']) # coverting to datetime format
+    # convert string dates into date format, parsing each distinct date once
+    dfN['date'] = parse_dates(dfN['date']) # coverting to datetime format
+    dfN = dfN[dfN['date'].notna()]
     dfN = dfN.sort_values(by='date')  # sorting lines by date
     start, end = dfN['date'].min(), today
 
     print('\n* Assigning epiweek column...')
     # get epiweek end date, create column
-    dfN['date'] = pd.to_datetime(dfN['date'], errors='coerce')
-    dfN['epiweek'] = dfN['date'].apply(lambda x: Week.fromdate(x, system="cdc").enddate())
+    dfN['epiweek'] = epiweek_enddates(dfN['date'])
 
 
     ## SAMPLE FOCAL AND CONTEXTUAL SEQUENCES
     print('\n* Filtering based on sampling scheme...')
+    # rows are sampled by position, and samples already selected are masked instead of dropped from the dataframe
+    # selections only depend on the seed, the scheme and the metadata, so reruns on the same inputs pick the same genomes
+    seed = scheme_seed(args.seed, scheme)
+    previous = {}
+    if previous_manifest != None:
+        previous = read_manifest(previous_manifest)
+        if previous == {}:
+            print('\n* No previous selection found, genomes will be sampled from scratch')
+    sampler = StratifiedSampler(dfN, seed=seed, previous=previous)
+    requests = []
+    selections = []
     purposes = ['focus', 'context']
-    subsamplers = [] # list of focal and contextual categories
     for category in purposes:
-        query = {} # create a dict for each 'purpose'
         for idx, value1 in dfS.loc[dfS['purpose'] == category, 'value'].to_dict().items():
             print('\n > Filter #' + str(idx))
 
@@ -130,13 +144,13 @@ if __name__ == '__main__':
                     results[id][filter1][value1] = []
 
             # keep only data that match filter1
-            dfFilter = dfN[dfN[filter1].isin([value1])]
+            filters = [(filter1, value1)]
 
             filter2 = dfS.iloc[idx]['filter2']
             value2 = dfS.iloc[idx]['value2']
             if value2 not in [None, np.nan]:
                 print('\t    - Also filtering by ' + filter2 + ': ' + value2)
-                dfFilter = dfFilter[dfFilter[filter2].isin([value2])]
+                filters.append((filter2, value2))
 
             # define new chronological boundaries, if provided
             min_date, max_date = start, end
@@ -149,50 +163,43 @@ if __name__ == '__main__':
                 max_date = new_end
                 print('\t    - Applying end time filter: ' + max_date)
 
-            # drop any row with dates outside the start/end dates
-            mask = (dfFilter['date'] >= min_date) & (dfFilter['date'] <= max_date)
-            dfFilter = dfFilter.loc[mask]  # apply mask
-            # print(dfFilter[['strain', 'date']])
-
-            gEpiweek = dfFilter.groupby('epiweek')
+            # genome selector: genomes per epiweek, proportional to the genomes available in each epiweek
             sample_size = dfS.iloc[idx]['sample_size']
-            total_genomes = dfFilter[filter1].count()
-            # print(total_genomes, sample_size)
-
-            drop_now = []
-            for epiweek, dfEpiweek in gEpiweek:
-                bin_pool = dfEpiweek['epiweek'].count() # genomes in bin
-                sampled = int(np.ceil((bin_pool/total_genomes) * sample_size)) # proportion sampled from bin
-                if sampled > bin_pool: # if requested amount is higher than available genomes, get all
-                    sampled = bin_pool
-
-                # genome selector
-                random_subset = dfEpiweek.sample(n=sampled)
-                for id in results.keys():
-                    selected = random_subset[id].to_list()
-                    results[id][filter1][value1] = results[id][filter1][value1] + selected
-                    if id == 'gisaid_epi_isl':
-                        drop_now = drop_now + selected
-
-            # drop pre-selected samples to prevent duplicates
-            dfN = dfN[~dfN['gisaid_epi_isl'].isin(drop_now)]
+            key = category_key(dfS.iloc[idx][['purpose', 'filter', 'value', 'filter2', 'value2', 'start', 'end']].fillna(''))
+            requests.append({'filters': filters, 'sample_size': sample_size, 'start': min_date, 'end': max_date,
+                             'salt': idx, 'category': key})
+            selections.append((idx, category, filter1, value1, key))
+
+    # rows of the scheme are matched in parallel, and sampled in order, so focal genomes are picked first
+    print('\n* Sampling genomes' + (' (' + str(args.cores) + ' processes)' if args.cores > 1 else '') + '...')
+    selections = [selection + (selected,) for selection, selected in zip(selections, sampler.sample_all(requests, args.cores))]
+    for idx, category, filter1, value1, key, selected in selections:
+        for id in results.keys():
+            results[id][filter1][value1].extend(dfN[id].values[selected].tolist())
+        if previous_manifest != None:
+            print('\t - Filter #' + str(idx) + ', epiweeks resampled: ' + str(len(sampler.changed(key))) + ' out of ' + str(len(sampler.strata[key])))
+
+    if manifest != None:
+        columns = ['row', 'purpose', 'filter', 'value', 'category', 'epiweek', 'pool', 'quota', 'strain', 'gisaid_epi_isl']
+        rows = []
+        for idx, category, filter1, value1, key, selected in selections:
+            for epiweek, strain, accno in zip(sampler.epiweeks(selected), dfN['strain'].values[selected], dfN['gisaid_epi_isl'].values[selected]):
+                rows.append((idx, category, filter1, value1, key, epiweek) + sampler.strata[key][epiweek] + (strain, accno))
+        write_manifest(manifest, {'seed': args.seed, 'scheme': scheme_digest(scheme)}, columns, rows)
 
     ### EXPORT RESULTS
     print('\n\n# Genomes sampled per category in subsampling scheme\n')
-    exported = []
-
-    outfile_names = open('selected_names.txt', 'w')
-    outfile_names.write('# Genomes selected on ' + today + '\n')
-    outfile_accno = open('selected_accession.txt', 'w')
-    outfile_accno.write('# Genomes selected on ' + today + '\n')
+    exported = set()
 
+    # lines of the lists of names and accession numbers, written at once at the end
+    outlines = {id: ['# Genomes selected on ' + today] for id in results.keys()}
 
     if report != None:
         outfile2 = open(report, 'w')
         outfile2.write('sample_size' + '\t' + 'category' + '\n')
 
     # export list selected genomes
-    reported = []
+    reported = set()
     genome_count = ''
     for id in results.keys():
         genome_count = 0
@@ -203,34 +210,30 @@ if __name__ == '__main__':
                     entry = str(len(entries)) + '\t' + value + ' (' + filter1 + ')'
                     if entry not in reported:
                         print('\t' + entry)
-                    if report != None and entry not in reported:
-                        outfile2.write(entry + '\n')
-                    reported.append(entry)
+                        if report != None:
+                            outfile2.write(entry + '\n')
+                        reported.add(entry)
 
+                    # every sampled genome is listed, even if its name is repeated or listed in keep.txt
                     for genome in entries:
-                        if genome not in [exported + to_keep]:
-                            if id == 'strain':
-                                outfile_names.write(genome + '\n')
-                            else:
-                                outfile_accno.write(genome + '\n')
-                            exported.append(genome)
+                        outlines[id].append(genome)
+                        exported.add(genome)
 
     # report selected samples listed in keep.txt
     not_found = []
     if len(to_keep) > 0:
         print('\t- ' + str(len(to_keep)) + ' genome(s) added from pre-selected list\n')
-        outfile_names.write('\n# Pre-selected genomes listed in keep.txt\n')
-        outfile_accno.write('\n# Pre-selected genomes listed in keep.txt\n')
+        for id in outlines.keys():
+            outlines[id].append('\n# Pre-selected genomes listed in keep.txt')
         for genome in to_keep:
             if genome not in exported:
-                outfile_names.write(genome + '\n')
+                outlines['strain'].append(genome)
                 if genome in name_accno:
                     genome = name_accno[genome]
-                    outfile_accno.write(genome + '\n')
+                    outlines['gisaid_epi_isl'].append(genome)
                 else:
                     not_found.append(genome)
-                exported.append(genome)
-
+                exported.add(genome)
 
         warning = 0
         for level, name in results['strain'].items():
@@ -252,5 +255,26 @@ if __name__ == '__main__':
         for name in not_found:
             print('\t- ' + name)
 
+    with open('selected_names.txt', 'w') as outfile_names:
+        outfile_names.write('\n'.join(outlines['strain']) + '\n')
+    with open('selected_accession.txt', 'w') as outfile_accno:
+        outfile_accno.write('\n'.join(outlines['gisaid_epi_isl']) + '\n')
+
     print('\n' + str(genome_count) + ' genome(s) exported according to subsampling scheme\n')
 
+    # report changes of sampled genomes since the previous selection
+    if previous_manifest != None:
+        previous_accno = set(genome for bins in previous.values() for pool, quota, genomes in bins.values() for genome in genomes)
+        selected_accno = set(genome for selection in selections for genome in dfN['gisaid_epi_isl'].values[selection[-1]])
+        added = selected_accno - previous_accno
+        dropped = previous_accno - selected_accno
+        print('# Changes since the previous selection')
+        print('\t' + str(len(added)) + ' genome(s) added, ' + str(len(dropped)) + ' genome(s) dropped, ' +
+              str(len(selected_accno & previous_accno)) + ' genome(s) kept\n')
+        if delta != None:
+            with open(delta, 'w') as outfile:
+                outfile.write('change' + '\t' + 'gisaid_epi_isl' + '\n')
+                for genome in sorted(added):
+                    outfile.write('added' + '\t' + genome + '\n')
+                for genome in sorted(dropped):
+                    outfile.write('dropped' + '\t' + genome + '\n')
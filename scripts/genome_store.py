@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Indexed genome store: convert a GISAID FASTA or JSON (NDJSON) dump once into
+a SQLite index plus a blob of zlib-compressed sequences, so that scripts can
+fetch only the records they need instead of re-parsing the full dump.
+
+    <store>.sqlite  -> one row per record: source file, header, strain, size, blob offset
+    <store>.blob    -> compressed sequences, appended in input order
+
+Records belong to the file they were read from, and queries only return records
+of a given file. When records are appended to that file, only the new ones are
+indexed; when it changes otherwise, all its records are indexed again, and the
+blob is compacted to drop sequences of the records replaced.
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import zlib
+from strain_names import gisaid_name
+from gisaid_json import read_records
+from sequence_qc import sequence_size
+
+version = 3  # increased whenever the way records are indexed changes (e.g. strain names), to rebuild older stores
+TAIL = 1024  # bytes before the end of the indexed part of a file, used to recognize it
+
+
+def _tail_digest(path, size):
+    with open(path, 'rb') as infile:
+        infile.seek(max(0, size - TAIL))
+        return hashlib.sha1(infile.read(min(size, TAIL))).hexdigest()
+
+
+# iterate over (header, sequence) pairs in a FASTA file, from byte offset start (a header line)
+def read_fasta(path, start=0):
+    header, lines = None, []
+    with open(path) as infile:
+        infile.seek(start)
+        for line in infile:
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(lines)
+                header, lines = line[1:].rstrip(), []
+            elif header is not None:
+                lines.append(line.rstrip().replace(' ', ''))
+    if header is not None:
+        yield header, ''.join(lines)
+
+
+# iterate over (header, sequence) pairs in a GISAID JSON file, skipping corrupted rows
+def read_json(path, start=0):
+    for entry in read_records(path, fields=['covv_virus_name', 'sequence'], start=start):
+        try:
+            yield entry['covv_virus_name'], entry['sequence'].replace('\n', '')
+        except (KeyError, AttributeError):
+            print('Corrupted JSON row detected. Skipping...')
+
+
+def read_genomes(path, start=0):
+    if path.split('.')[1] == 'json':
+        return read_json(path, start)
+    return read_fasta(path, start)
+
+
+class GenomeStore:
+    ''' Records are kept per source file: updating a source extends or replaces its records, and queries only see one source '''
+    def __init__(self, path):
+        self.path = path
+        self.blob_path = path + '.blob'
+        self.db = sqlite3.connect(path + '.sqlite')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != version:
+            # stores created by other versions are rebuilt
+            self.db.execute('DROP TABLE IF EXISTS records')
+            self.db.execute('DROP TABLE IF EXISTS sources')
+            self.db.execute('DROP TABLE IF EXISTS pending')
+            self.db.execute('PRAGMA user_version = ' + str(version))
+        self.db.execute('CREATE TABLE IF NOT EXISTS records (source TEXT, header TEXT, strain TEXT, '
+                        'size INTEGER, length INTEGER, offset INTEGER, nbytes INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_strain ON records (source, strain)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_header ON records (source, header)')
+        # size, modification time and tail digest of the part of each file indexed, and rowid of its last record
+        self.db.execute('CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                        'tail TEXT, last INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pending (blob TEXT)')  # compacted blob not yet in place
+        self.db.commit()
+        self.finish_compaction()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self, genomes):
+        ''' True if the dump was already loaded, and has not changed since '''
+        stat = os.stat(genomes)
+        row = self.db.execute('SELECT size, mtime FROM sources WHERE path = ?', (os.path.abspath(genomes),)).fetchone()
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+    def appended(self, genomes, size, tail):
+        ''' True if the file only has new records after the size indexed, whose end it still matches '''
+        if os.path.getsize(genomes) <= size or size == 0 or _tail_digest(genomes, size) != tail:
+            return False
+        with open(genomes, 'rb') as infile:
+            infile.seek(size - 1)
+            boundary = infile.read(2)
+        # the indexed part ends with a line break, followed by a new header (FASTA) or a new row (JSON)
+        return boundary[:1] == b'\n' and (genomes.split('.')[1] == 'json' or boundary[1:] == b'>')
+
+    def update(self, genomes, batch_size=10000):
+        ''' Index records of a FASTA or JSON dump: only those appended since it was last indexed, if the rest of
+        the file did not change, otherwise all of them, replacing those of its previous version.
+        Returns number of records indexed, or 0 if the file did not change '''
+        if self.is_current(genomes):
+            return 0
+
+        source = os.path.abspath(genomes)
+        row = self.db.execute('SELECT size, tail, last FROM sources WHERE path = ?', (source,)).fetchone()
+        start = 0
+        with self.db:
+            if row is not None and self.appended(genomes, row[0], row[1]):
+                start = row[0]
+                # records of an interrupted update are indexed again
+                self.db.execute('DELETE FROM records WHERE source = ? AND rowid > ?', (source, row[2]))
+            else:
+                self.db.execute('DELETE FROM records WHERE source = ?', (source,))
+                self.db.execute('DELETE FROM sources WHERE path = ?', (source,))
+        self.compact()
+
+        size, mtime = os.path.getsize(genomes), os.stat(genomes).st_mtime
+        added = 0
+        rows = []
+        with open(self.blob_path, 'ab') as blob:
+            for header, seq in read_genomes(genomes, start):
+                strain = gisaid_name(header)
+                data = zlib.compress(seq.encode())
+                rows.append((source, header, strain, sequence_size(seq), len(seq), blob.tell(), len(data)))
+                blob.write(data)
+                added += 1
+                if len(rows) >= batch_size:
+                    blob.flush()
+                    self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                    self.db.commit()
+                    rows = []
+            blob.flush()
+            self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+        # the source is recorded last, so an interrupted update is redone by the next run
+        last = self.db.execute('SELECT COALESCE(MAX(rowid), 0) FROM records WHERE source = ?', (source,)).fetchone()[0]
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)',
+                        (source, size, mtime, _tail_digest(genomes, size), last))
+        self.db.commit()
+        return added
+
+    def compact(self):
+        ''' Drop sequences of records no longer indexed from the blob: by truncating it, if they are at its end,
+        otherwise by copying the others to a new blob '''
+        used, end = self.db.execute('SELECT COALESCE(SUM(nbytes), 0), COALESCE(MAX(offset + nbytes), 0) FROM records').fetchone()
+        total = os.path.getsize(self.blob_path) if os.path.exists(self.blob_path) else 0
+        if used == end:
+            if total > end:
+                with open(self.blob_path, 'r+b') as blob:
+                    blob.truncate(end)
+            return
+
+        compacted = os.path.abspath(self.blob_path + '.compacted')
+        moved = []
+        with open(self.blob_path, 'rb') as blob, open(compacted, 'wb') as outfile:
+            for rowid, offset, nbytes in self.db.execute('SELECT rowid, offset, nbytes FROM records ORDER BY offset'):
+                blob.seek(offset)
+                moved.append((outfile.tell(), rowid))
+                outfile.write(blob.read(nbytes))
+        # offsets are committed along with a note that the new blob must replace the old one, even if interrupted
+        with self.db:
+            self.db.executemany('UPDATE records SET offset = ? WHERE rowid = ?', moved)
+            self.db.execute('INSERT INTO pending VALUES (?)', (compacted,))
+        self.finish_compaction()
+
+    def finish_compaction(self):
+        row = self.db.execute('SELECT blob FROM pending').fetchone()
+        if row is None:
+            if os.path.exists(self.blob_path + '.compacted'):
+                os.remove(self.blob_path + '.compacted')  # left by a compaction interrupted before its commit
+            return
+        if os.path.exists(row[0]):
+            os.replace(row[0], self.blob_path)
+        with self.db:
+            self.db.execute('DELETE FROM pending')
+
+    def count(self, genomes):
+        ''' Number of records of a source file '''
+        return self.db.execute('SELECT COUNT(*) FROM records WHERE source = ?', (os.path.abspath(genomes),)).fetchone()[0]
+
+    def headers(self, genomes):
+        ''' Iterate over (header, strain, size) of all records of a source file, in input order, without reading sequences '''
+        return self.db.execute('SELECT header, strain, size FROM records WHERE source = ? ORDER BY rowid',
+                               (os.path.abspath(genomes),))
+
+    def _select(self, column, names, genomes):
+        self.db.execute('DROP TABLE IF EXISTS temp.targets')
+        self.db.execute('CREATE TEMP TABLE targets (name TEXT PRIMARY KEY)')
+        self.db.executemany('INSERT OR IGNORE INTO temp.targets VALUES (?)', ((name,) for name in names))
+        return self.db.execute('SELECT records.header, records.strain, records.offset, records.nbytes FROM records '
+                               'JOIN temp.targets ON records.' + column + ' = temp.targets.name '
+                               'WHERE records.source = ? ORDER BY records.rowid', (os.path.abspath(genomes),)).fetchall()
+
+    def count_matches(self, strains, genomes):
+        ''' Number of records of a source file whose strain name is listed in strains '''
+        return len(self._select('strain', strains, genomes))
+
+    def _read(self, rows):
+        with open(self.blob_path, 'rb') as blob:
+            for header, strain, offset, nbytes in rows:
+                blob.seek(offset)
+                yield header, strain, zlib.decompress(blob.read(nbytes)).decode()
+
+    def fetch(self, strains, genomes):
+        ''' Iterate over (header, strain, sequence) of records of a source file matching strain names, in input order.
+        Records are looked up at once, and sequences read from the blob while iterating, even after the store is closed '''
+        return self._read(self._select('strain', strains, genomes))
+
+    def fetch_headers(self, headers, genomes):
+        ''' Iterate over (header, strain, sequence) of records of a source file matching full headers, as fetch does '''
+        return self._read(self._select('header', headers, genomes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Create or update an indexed genome store from a GISAID FASTA or JSON file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--genomes", required=True, nargs='+', help="FASTA or JSON file(s) with genomes from GISAID")
+    parser.add_argument("--store", required=True, help="Path prefix of the genome store (.sqlite and .blob files)")
+    args = parser.parse_args()
+
+    with GenomeStore(args.store) as store:
+        for genomes in args.genomes:
+            print('\n### Loading ' + genomes)
+            added = store.update(genomes)
+            print(str(added) + ' genomes indexed' if added else 'Already up to date')
+            print('Genome store contains ' + str(store.count(genomes)) + ' genomes of ' + genomes)
+        print('')
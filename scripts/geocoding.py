@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Geocoding of place names, with a persistent cache and a rate-limited thread pool
+
+Queries are deduplicated, and looked up in a SQLite cache that also keeps places
+that were not found, so reruns only search new places. The remaining queries are
+sent to a backend (Nominatim, or a TSV table as an offline stand-in) by a few
+worker threads, never faster than the rate allowed by the provider.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import sqlite3
+import time
+
+
+class NominatimBackend:
+    ''' OpenStreetMap Nominatim, limited to 1 request per second by its usage policy '''
+    rate = 1.0
+
+    def __init__(self, user_agent, language='en', timeout=10):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+        self.language = language
+
+    def __call__(self, query):
+        location = self.geolocator.geocode(query, language=self.language)
+        if location is None:
+            return None
+        return (str(location.latitude), str(location.longitude))
+
+
+class TableBackend:
+    ''' Offline stand-in: coordinates from a TSV file with query, latitude and longitude '''
+    rate = 0
+
+    def __init__(self, path):
+        self.coordinates = {}
+        for line in open(path).readlines():
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 3:
+                self.coordinates[fields[0]] = (fields[1], fields[2])
+
+    def __call__(self, query):
+        return self.coordinates.get(query)
+
+
+class RateLimiter:
+    ''' Space out calls from any number of threads by at least 1/rate seconds '''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_call)
+            self.next_call = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Geocoder:
+    ''' Geocode queries with a backend, caching coordinates and misses in SQLite '''
+    def __init__(self, backend, cache=':memory:', rate=None, workers=2, retries=2):
+        self.backend = backend
+        self.limiter = RateLimiter(backend.rate if rate is None else rate)
+        self.workers = workers
+        self.retries = retries
+        self.db = sqlite3.connect(cache)
+        self.db.execute('CREATE TABLE IF NOT EXISTS places (query TEXT PRIMARY KEY, latitude TEXT, longitude TEXT, '
+                        'found INTEGER, updated REAL)')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cached(self, queries, retry_missing=False):
+        ''' Dict of cached results of queries: (latitude, longitude), or None for places not found '''
+        found = {}
+        queries = list(queries)
+        for start in range(0, len(queries), 500):
+            batch = queries[start:start + 500]
+            rows = self.db.execute('SELECT query, latitude, longitude, found FROM places WHERE query IN (' +
+                                   ','.join('?' * len(batch)) + ')', batch)
+            for query, lat, long, hit in rows:
+                if hit:
+                    found[query] = (lat, long)
+                elif not retry_missing:
+                    found[query] = None
+        return found
+
+    # errors (e.g. timeouts) are retried, and reported as None without being cached
+    def _search(self, query):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                return True, self.backend(query)
+            except Exception as error:
+                if attempt == self.retries:
+                    print('\t* WARNING! Geocoding failed for: ' + query + ' (' + str(error) + ')')
+                else:
+                    time.sleep(2 ** attempt)
+        return False, None
+
+    def geocode(self, queries, retry_missing=False):
+        ''' Dict of (latitude, longitude), or None, for each distinct query '''
+        queries = list(dict.fromkeys(queries))
+        results = self.cached(queries, retry_missing)
+        missing = [query for query in queries if query not in results]
+        if not missing:
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            searches = {pool.submit(self._search, query): query for query in missing}
+            for future in as_completed(searches):
+                query = searches[future]
+                done, coord = future.result()
+                results[query] = coord
+                if done:
+                    lat, long = coord if coord is not None else (None, None)
+                    self.db.execute('INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?)',
+                                    (query, lat, long, int(coord is not None), time.time()))
+                    self.db.commit()
+        return results
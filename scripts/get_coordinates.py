@@ -7,12 +7,12 @@
 # Last update: 2021-07-12
 
 import pandas as pd
-from geopy.geocoders import Nominatim
 import argparse
-from bs4 import BeautifulSoup as BS
 import numpy as np
+from geocoding import Geocoder, NominatimBackend, TableBackend
+from place_manifest import Manifest, distinct_places, file_digest
 
-geolocator = Nominatim(user_agent="email@gmail.com")  # add your email here
+user_agent = "email@gmail.com"  # add your email here
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -24,6 +24,12 @@ if __name__ == '__main__':
     parser.add_argument("--columns", nargs='+', type=str, help="list of columns that need coordinates")
     parser.add_argument("--cache", required=False, help="TSV file with preexisting latitudes and longitudes")
     parser.add_argument("--output", required=True, help="TSV file containing geographic coordinates")
+    parser.add_argument("--geocoder-cache", required=False, default=':memory:', help="SQLite file with results of previous searches, including places not found")
+    parser.add_argument("--retry-not-found", required=False, action='store_true', help="Search again places not found in previous runs")
+    parser.add_argument("--backend", required=False, default='nominatim', help="'nominatim', or a TSV file with queries, latitudes and longitudes")
+    parser.add_argument("--rate", required=False, type=float, help="Maximum number of searches per second (default: the limit of the backend)")
+    parser.add_argument("--threads", required=False, type=int, default=2, help="Number of concurrent searches")
+    parser.add_argument("--manifest", required=False, help="JSON file with places and results of the previous run, to skip searches when nothing changed")
     args = parser.parse_args()
 
     metadata = args.metadata
@@ -60,8 +66,8 @@ if __name__ == '__main__':
 
     # extract coordinates from TSV file
     scheme_list = open(geoscheme, "r").readlines()[1:]
-    dont_search = []
-    set_countries = []
+    dont_search = set()
+    set_countries = set()
     for line in scheme_list:
         if not line.startswith('\n'):
             type = line.split('\t')[0]
@@ -76,72 +82,112 @@ if __name__ == '__main__':
 
                     if subarea not in results[type]:
                         results[type].update(coordinates)
-                        dont_search.append(subarea)
+                        dont_search.add(subarea)
                     country_name = subarea.split('-')[0]
-                    if type == 'country' and country_name not in set_countries:
-                        set_countries.append(country_name)
+                    if type == 'country':
+                        set_countries.add(country_name)
                 except:
                     pass
 
 
-    # find coordinates for locations not found in cache or XML file
-    def find_coordinates(place):
-        try:
-            location = geolocator.geocode(place, language='en')
-            lat, long = location.latitude, location.longitude
-            coord = (str(lat), str(long))
-            return coord
-        except:
-            coord = ('NA', 'NA')
-            return coord
+    # replay searches in the order of the metadata: for each place, queries are tried until one is found.
+    # queries whose results are still unknown are returned, to be searched at once before the next replay
+    def replay(searches, geocoded, verbose=False):
+        found = {trait: {} for trait in columns}
+        not_found, failed, pending, unknown = [], set(), set(), []
+        for trait, target, query in searches:
+            item = (trait, query)
+            if target in found[trait] or (trait, target) in pending or item in failed:
+                continue
+            if query not in geocoded:
+                pending.add((trait, target))
+                unknown.append(query)
+                continue
+            coord = geocoded[query]
+            if coord is None:
+                failed.add(item)
+                not_found.append(item)
+                if verbose:
+                    print('\t* WARNING! Coordinates not found for: ' + trait + ', ' + query)
+            else:
+                found[trait][target] = coord
+                if verbose:
+                    print(trait + ', ' + target + '. Coordinates = ' + ', '.join(coord))
+        return found, not_found, unknown
 
 
     # open metadata file as dataframe
-    dfN = pd.read_csv(metadata, encoding='utf-8', sep='\t')
-
-    queries = []
-    pinpoints = [dfN[trait].values.tolist() for trait in columns if trait != 'region']
-    for address in zip(*pinpoints):
-        traits = [trait for trait in columns if trait != 'region']
-        for position, place in enumerate(address):
-            level = traits[position]
-            query = list(address[0:position + 1])
-            queries.append((level, query))
-
-    not_found = []
-    for unknown_place in queries:
-        trait, place = unknown_place[0], unknown_place[1]
-        target = place[-1]
-        if target not in ['', 'NA', 'NAN', 'unknown', '-', np.nan, None]:
-            try:
-                if place[0].split('-')[0] in set_countries:
-                    country_short = place[0].split('-')[0]  # correcting TSV pre-defined country names
-                    place[0] = country_short
-            except:
-                pass
-
-            if target not in results[trait]:
-                new_query = []
-                for name in place:
-                    if name not in dont_search:
-                        if place[0] == 'USA':
-                            if name != 'USA':
-                                name = name + ' state'
-                        if name not in new_query:
-                            new_query.append(name)
-
-                item = (trait, ', '.join(new_query))
-                coord = ('NA', 'NA')
-                if item not in not_found:
-                    coord = find_coordinates(', '.join(new_query))  # search coordinates
-                if 'NA' in coord:
-                    if item not in not_found:
-                        not_found.append(item)
-                        print('\t* WARNING! Coordinates not found for: ' + trait + ', ' + ', '.join(new_query))
-                else:
-                    print(trait + ', ' + target + '. Coordinates = ' + ', '.join(coord))
-                    entry = {target: coord}
-                    results[trait].update(entry)
+    traits = [trait for trait in columns if trait != 'region']
+    dfN = pd.read_csv(metadata, encoding='utf-8', sep='\t', usecols=traits)
+    addresses = dfN[traits].drop_duplicates()
+
+    # find coordinates for locations not found in cache or XML file
+    def find_coordinates(addresses):
+        if args.backend == 'nominatim':
+            backend = NominatimBackend(user_agent)
+        else:
+            backend = TableBackend(args.backend)
+        geocoder = Geocoder(backend, args.geocoder_cache, args.rate, args.threads)
+
+        # plan queries over distinct addresses only: all countries first, then divisions, then locations,
+        # each level in order of first appearance in the metadata
+        queries = []
+        for position, level in enumerate(traits):
+            for address in addresses[traits[:position + 1]].drop_duplicates().itertuples(index=False, name=None):
+                queries.append((level, list(address)))
+
+        searches = []
+        for trait, place in queries:
+            target = place[-1]
+            if target not in ['', 'NA', 'NAN', 'unknown', '-', np.nan, None]:
+                try:
+                    if place[0].split('-')[0] in set_countries:
+                        country_short = place[0].split('-')[0]  # correcting TSV pre-defined country names
+                        place[0] = country_short
+                except:
+                    pass
+
+                if target not in results[trait]:
+                    new_query = []
+                    for name in place:
+                        if name not in dont_search:
+                            if place[0] == 'USA':
+                                if name != 'USA':
+                                    name = name + ' state'
+                            if name not in new_query:
+                                new_query.append(name)
+                    searches.append((trait, target, ', '.join(new_query)))
+
+        # each distinct query is searched at most once, with results cached across runs
+        geocoded = {}
+        found, not_found, unknown = replay(searches, geocoded)
+        while unknown:
+            geocoded.update(geocoder.geocode(unknown, args.retry_not_found))
+            found, not_found, unknown = replay(searches, geocoded)
+        found, not_found, unknown = replay(searches, geocoded, verbose=True)
+        geocoder.close()
+        for trait in columns:
+            results[trait].update(found[trait])
+        return not_found
+
+
+    # in incremental mode, results of the previous run are reused when places and inputs did not change.
+    # A cache identical to the previous output (copied over by the workflow) stands for the cache that run read
+    manifest = Manifest(args.manifest)
+    places = distinct_places(addresses, traits)
+    cache_digest = file_digest(cache)
+    if cache_digest != '' and cache_digest == manifest.get('output'):
+        cache_digest = manifest.get('cache')
+    inputs = {'geoscheme': file_digest(geoscheme), 'columns': columns, 'cache': cache_digest,
+              'backend': args.backend if args.backend == 'nominatim' else file_digest(args.backend)}
+    previous = None if args.retry_not_found else manifest.report(places, inputs)
+    if previous is not None:
+        results = {trait: {} for trait in columns}
+        for trait, place, lat, long in previous['coordinates']:
+            results[trait][place] = (lat, long)
+        not_found = [tuple(item) for item in previous['not_found']]
+    else:
+        not_found = find_coordinates(addresses)
 
     print('\n### These coordinates were found and saved in the output file:')
     with open(output, 'w') as outfile:
@@ -157,6 +203,11 @@ if __name__ == '__main__':
                 outfile.write(line)
             outfile.write('\n')
 
+    if previous is None:
+        coordinates = [[trait, place, coord[0], coord[1]] for trait, lines in results.items() for place, coord in lines.items()]
+        manifest.save(places, inputs, {'coordinates': coordinates, 'not_found': not_found},
+                      cache=cache_digest, output=file_digest(output))
+
     if len(not_found) > 1:
         print('\n### WARNING! Some coordinates were not found (see below).'
               '\nTypos or especial characters in place names my explain such errors.'
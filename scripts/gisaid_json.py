@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Parallel reader for GISAID JSON (NDJSON) provision files
+
+The file is split into byte ranges aligned to line breaks, which are parsed in a
+process pool (with orjson, when installed). Records are yielded in the original
+file order, and can be restricted to a few fields to save memory and pickling.
+"""
+
+from collections import deque
+import multiprocessing
+import json
+import os
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+chunk_size = 32 * 1024 * 1024  # bytes per parsing task
+
+
+# byte offsets of chunks of approximately chunk_size from start, each ending at a line break
+def chunk_ranges(path, size=chunk_size, start=0):
+    total = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as infile:
+        while start < total:
+            infile.seek(min(start + size, total))
+            infile.readline()
+            end = min(infile.tell(), total)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# parse one byte range; corrupted rows (invalid JSON, or not an object) are returned as None, to be reported by the caller
+def parse_chunk(task):
+    path, start, end, fields = task
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        lines = infile.read(end - start).split(b'\n')
+
+    records = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = loads(line)
+        except ValueError:
+            entry = None
+        if not isinstance(entry, dict):  # invalid JSON, or rows that are not objects
+            records.append(None)
+            continue
+        if fields is not None:
+            entry = {field: entry[field] for field in fields if field in entry}
+        records.append(entry)
+    return records
+
+
+def read_records(path, fields=None, processes=None, size=chunk_size, start=0):
+    ''' Iterate over records (dicts) of a GISAID JSON file, in file order, from byte offset start (a line break).
+    Only keys in fields are kept, if provided '''
+    tasks = [(path, begin, end, fields) for begin, end in chunk_ranges(path, size, start)]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        results = (parse_chunk(task) for task in tasks)
+        for records in results:
+            for entry in _report_corrupted(records):
+                yield entry
+        return
+
+    # keep a bounded number of chunks in flight, so memory does not grow with file size
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        tasks = iter(tasks)
+        for task in tasks:
+            pending.append(pool.apply_async(parse_chunk, (task,)))
+            if len(pending) >= processes * 2:
+                break
+        while pending:
+            records = pending.popleft().get()
+            for task in tasks:
+                pending.append(pool.apply_async(parse_chunk, (task,)))
+                break
+            for entry in _report_corrupted(records):
+                yield entry
+
+
+def _report_corrupted(records):
+    for entry in records:
+        if entry is None:
+            print('Corrupted JSON row detected. Skipping...')
+        else:
+            yield entry
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+ISO 3166-1 alpha-3 codes of country names
+
+Names are looked up in a prebuilt table (config/iso_codes.tsv: country names and
+codes from pycountry_convert, overrides for territories and misspellings, and the
+members of the geoscheme). Only names missing from it are searched with pycountry,
+once per run (empty codes when nothing is found).
+
+Run as a script to rebuild the table.
+"""
+
+import argparse
+import os
+import pandas as pd
+
+config_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'config'))
+table_path = os.path.join(config_dir, 'iso_codes.tsv')
+
+# overseas territories, and names missing (or resolved to another code) in pycountry
+overrides = {'British Virgin Islands':'VGB','Cayman Islands':'CYM','Guam':'GUM','US Virgin Islands':'VIR','Virgin Islands':'VIR',
+             'Puerto Rico':'PRI','Northern Mariana Islands':'MNP','Sint Maarten':'MAF','Sint Eustatius':'BES','St Eustatius':'BES',
+             'Bonaire':'BES','Saba':'BES','Martinique':'MTQ','French Guiana':'GUF','Montserrat':'MSR','Turks and Caicos':'TCA',
+             'Anguilla':'AIA','Mayotte':'MYT','Reunion':'REU','Wallis and Futuna':'WLF','Curacao':'CUW'}
+
+
+def read_codes(path):
+    codes = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as infile:
+            next(infile, None)  # header
+            for line in infile:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 2:
+                    codes[fields[0]] = fields[1]
+    return codes
+
+
+def write_codes(path, codes):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write('name\tiso\n')
+        for name, iso in codes.items():
+            outfile.write(name + '\t' + iso + '\n')
+
+
+# exact matches of pycountry_convert (names and alpha-3 codes), with overrides
+def build_table():
+    import pycountry_convert as pyCountry
+    from pycountry_convert.country_mappings import list_country_alpha3
+
+    codes = dict(pyCountry.map_country_name_to_country_alpha3('default'))
+    codes.update({iso: iso for iso in list_country_alpha3()})
+    codes.update(overrides)
+    return codes
+
+
+def fuzzy_search(country):
+    import pycountry
+    try:
+        return pycountry.countries.search_fuzzy(country)[0].alpha_3
+    except LookupError:
+        return ''
+
+
+class IsoResolver:
+    ''' Resolve country names to ISO alpha-3 codes, with a prebuilt table, and fuzzy searches of other names '''
+    def __init__(self, table=table_path):
+        self.codes = read_codes(table)
+        if not self.codes:
+            self.codes = build_table()
+        self.codes.update(overrides)
+
+    def resolve(self, countries):
+        ''' Dict of codes for an iterable of names; names not found give empty codes '''
+        names = set(country for country in countries if isinstance(country, str))
+        missing = sorted(names - self.codes.keys())
+        if missing:
+            self.codes.update({country: fuzzy_search(country) for country in missing})
+        return {country: self.codes.get(country, '') for country in countries}
+
+    def get_iso(self, country):
+        return self.resolve([country])[country]
+
+
+_resolver = None
+
+def resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = IsoResolver()
+    return _resolver
+
+
+def get_iso(country):
+    return resolver().get_iso(country)
+
+
+def iso_codes(countries):
+    ''' ISO codes of a Series of country names, resolved once per distinct name '''
+    return countries.map(resolver().resolve(pd.unique(countries)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the table of ISO alpha-3 codes of country names",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--geoscheme", required=False, help="Geoscheme TSV file, whose region members are resolved in advance")
+    parser.add_argument("--output", required=False, default=table_path, help="TSV file with names and ISO codes")
+    args = parser.parse_args()
+
+    codes = build_table()
+    if args.geoscheme:
+        for line in open(args.geoscheme).readlines()[1:]:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'region' and len(fields) > 5:
+                for country in fields[5].split(','):
+                    country = country.strip()
+                    if country and country not in codes:
+                        codes[country] = fuzzy_search(country)
+
+    write_codes(args.output, codes)
+    print('\n' + str(len(codes)) + ' country names successfully exported to ' + args.output + '\n')
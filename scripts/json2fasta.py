@@ -6,7 +6,8 @@
 # Last update: 2021-02-17
 
 import argparse
-import json
+from gisaid_json import read_records
+from strain_names import strain_name
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -27,19 +28,17 @@ if __name__ == '__main__':
 
     print('\n### Exporting sequences\n')
     outfile = open(output, 'w')
-    with open(json_file) as infile:
-        c = 0
-        for line in infile:
-            entry = json.loads(line)
-            id = entry['covv_virus_name'].replace('hCoV-19/', '').replace(' ', '')
-            seq = entry['sequence'].replace('\n','')
-            if int(len(seq)) >= min_size:
-                c += 1
-                print(str(c) + '. ' + id)
-                entry = ">" + id + "\n" + seq.upper() + "\n"
-                outfile.write(entry)
-            else:
-                print('- ' + id + ' is too small. Coverage = ' + str(round(float(len(seq)/genome_size) * 100, 2)) + '%')
+    c = 0
+    for entry in read_records(json_file, fields=['covv_virus_name', 'sequence']):
+        id = strain_name(entry['covv_virus_name'])
+        seq = entry['sequence'].replace('\n','')
+        if int(len(seq)) >= min_size:
+            c += 1
+            print(str(c) + '. ' + id)
+            entry = ">" + id + "\n" + seq.upper() + "\n"
+            outfile.write(entry)
+        else:
+            print('- ' + id + ' is too small. Coverage = ' + str(round(float(len(seq)/genome_size) * 100, 2)) + '%')
 
     outfile.close()
     print('\n' + str(c) + ' genomes successfully saved in ' + output + ' (coverage >= ' + str(100 - max_gaps) + '%)\n')
@@ -4,9 +4,61 @@
 Mask initial bases from alignment FASTA
 """
 import argparse
-import Bio
-import Bio.SeqIO
-from Bio.Seq import Seq
+import numpy as np
+from alignment_matrix import MatrixWriter
+
+chunk_size = 5000  # sequences masked at once
+
+
+# iterate over (header, sequence) pairs of an alignment, as bytes
+def read_alignment(path):
+    header, lines = None, []
+    with open(path, 'rb') as infile:
+        for line in infile:
+            if line.startswith(b'>'):
+                if header is not None:
+                    yield header, b''.join(lines)
+                header, lines = line[1:].rstrip(), []
+            elif header is not None:
+                lines.append(line.rstrip())
+    if header is not None:
+        yield header, b''.join(lines)
+
+
+# boolean vector of positions to be masked, for sequences of a given length
+def mask_vector(length, begin_length, end_length, sites):
+    mask = np.zeros(length, dtype=bool)
+    mask[:begin_length] = True
+    if end_length > 0:
+        mask[max(length - end_length, 0):] = True
+    sites = np.asarray(sites, dtype=int) - 1
+    mask[sites[(sites >= 0) & (sites < length)]] = True
+    return mask
+
+
+# mask a chunk of sequences with a single assignment per distinct sequence length
+def mask_chunk(records, masks, begin_length, end_length, sites):
+    by_length = {}
+    for position, (header, seq) in enumerate(records):
+        by_length.setdefault(len(seq), []).append(position)
+
+    masked = [None] * len(records)
+    for length, positions in by_length.items():
+        if length not in masks:
+            masks[length] = mask_vector(length, begin_length, end_length, sites)
+        matrix = np.frombuffer(b''.join(records[p][1] for p in positions), dtype=np.uint8).reshape(len(positions), length).copy()
+        matrix[:, masks[length]] = ord('N')
+        for row, p in zip(matrix, positions):
+            masked[p] = row.tobytes()
+
+    return masked
+
+
+def export_chunk(records, masked, outfile, matrix):
+    outfile.write(b''.join(b'>' + header + b'\n' + seq + b'\n' for (header, _), seq in zip(records, masked)))
+    if matrix is not None:
+        for (header, _), seq in zip(records, masked):
+            matrix.append(header.decode(), seq)
 
 
 if __name__ == '__main__':
@@ -19,24 +71,36 @@ if __name__ == '__main__':
     parser.add_argument("--mask-from-end", type = int, help="number of bases to mask from end")
     parser.add_argument("--mask-sites", nargs='+', type = int,  help="list of sites to mask")
     parser.add_argument("--output", required=True, help="FASTA file of output alignment")
+    parser.add_argument("--matrix", required=False, help="Prefix of a matrix alignment (.npy + .names, see alignment_matrix.py) to be exported as well")
     args = parser.parse_args()
 
-    being_length = 0
+    begin_length = 0
     if args.mask_from_beginning:
         begin_length = args.mask_from_beginning
     end_length = 0
     if args.mask_from_end:
         end_length = args.mask_from_end
+    sites = args.mask_sites or []
 
-    with open(args.output, 'w') as outfile:
-        for record in Bio.SeqIO.parse(args.alignment, 'fasta'):
-            seq = str(record.seq)
-            start = "N" * begin_length
-            middle = seq[begin_length:-end_length]
-            end = "N" * end_length
-            seq_list = list(start + middle + end)
-            if args.mask_sites:
-                for site in args.mask_sites:
-                    seq_list[site-1] = "N"
-            record.seq = Seq("".join(seq_list))
-            Bio.SeqIO.write(record, outfile, 'fasta')
+    # mask vectors are computed once per alignment length, and applied to chunks of sequences
+    masks = {}
+    matrix = None
+    try:
+        with open(args.output, 'wb') as outfile:
+            records = []
+            for record in read_alignment(args.alignment):
+                if args.matrix and matrix is None:
+                    matrix = MatrixWriter(args.matrix, len(record[1]))
+                records.append(record)
+                if len(records) == chunk_size:
+                    export_chunk(records, mask_chunk(records, masks, begin_length, end_length, sites), outfile, matrix)
+                    records = []
+            if records:
+                export_chunk(records, mask_chunk(records, masks, begin_length, end_length, sites), outfile, matrix)
+        if args.matrix and matrix is None:  # empty alignment
+            matrix = MatrixWriter(args.matrix, 0)
+    finally:
+        if matrix is not None:
+            matrix.close()
+    if matrix is not None and matrix.skipped > 0:
+        print('\n' + str(matrix.skipped) + ' sequences not matching the length of the first one were left out of ' + args.matrix + '.npy')
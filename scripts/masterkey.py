@@ -9,7 +9,9 @@ from Bio import Phylo
 from Bio import SeqIO
 import pandas as pd
 import argparse
-import json
+from gisaid_json import read_records
+from genome_store import GenomeStore
+from strain_names import strain_name
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -24,6 +26,7 @@ if __name__ == '__main__':
     parser.add_argument("--list", required=True, help="List of target taxa or sequences")
     parser.add_argument("--index", required=False, type=str,  help="Column name in TSV file where the listed taxa are found")
     parser.add_argument("--output", required=True, help="Filtered output file")
+    parser.add_argument("--store", required=False, help="Genome store (see genome_store.py) used to fetch sequences listed for 'keep' in FASTA format")
     args = parser.parse_args()
 
     input = args.input
@@ -32,6 +35,7 @@ if __name__ == '__main__':
     action = args.action[0]
     index = args.index
     output = args.output
+    store = args.store
 
 
     # input = path + "metadata.tsv"
@@ -156,8 +160,15 @@ if __name__ == '__main__':
             found = []  # store all found headers
             count = 1
             with open(output, 'w') as outfile:
-                for fasta in SeqIO.parse(open(input), 'fasta'):
-                    header, seq = fasta.description, fasta.seq
+                if store != None and action == 'keep':
+                    # random access to listed sequences, instead of parsing the full FASTA file
+                    with GenomeStore(store) as gs:
+                        gs.update(input)
+                        fetched = gs.fetch_headers(targets, input)
+                    records = ((header, seq) for header, strain, seq in fetched)
+                else:
+                    records = ((fasta.description, fasta.seq) for fasta in SeqIO.parse(open(input), 'fasta'))
+                for header, seq in records:
                     if action == 'keep':
                         if header not in found and header in targets:
                             found.append(header)
@@ -193,20 +204,18 @@ if __name__ == '__main__':
         found = []
         if action in ['keep']:
             with open(output, 'w') as outfile:
-                with open(input) as infile:
-                    count = 0
-                    for line in infile:
-                        entry = json.loads(line)
-                        header = entry['covv_virus_name'].replace('hCoV-19/', '').replace(' ', '').replace('\'', '-')
-                        if header not in found and header in targets:
-                            seq = entry['sequence'].replace('\n', '')
-                            print(str(count) + '. ' + header)
-                            entry = ">" + header + "\n" + seq.upper() + "\n"
-                            outfile.write(entry)
-                            found.append(header)
-                        count += 1
-                        if count % 10000 == 0:
-                            print(count)
+                count = 0
+                for entry in read_records(input, fields=['covv_virus_name', 'sequence']):
+                    header = strain_name(entry['covv_virus_name'])
+                    if header not in found and header in targets:
+                        seq = entry['sequence'].replace('\n', '')
+                        print(str(count) + '. ' + header)
+                        entry = ">" + header + "\n" + seq.upper() + "\n"
+                        outfile.write(entry)
+                        found.append(header)
+                    count += 1
+                    if count % 10000 == 0:
+                        print(count)
 
     if format == 'tsv':
         df1 = pd.read_csv(input, encoding='utf-8', sep='\t', dtype=str)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Manifests for incremental regeneration of coordinates and colours
+
+A manifest (JSON) records the distinct addresses of a build, in order of first
+appearance, checksums of the other inputs, and the results of the last run.
+When addresses and inputs are unchanged, those results are reused as they are;
+otherwise the places added and removed are reported, and scripts can reuse any
+partial results stored alongside (e.g. gradients of unchanged groups of places).
+Outputs only depend on the inputs, not on the state of previous runs.
+"""
+
+import hashlib
+import json
+import os
+
+
+def file_digest(path):
+    if path is None or not os.path.exists(path):
+        return ''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def distinct_places(df, columns):
+    ''' Distinct addresses (lists of names, None for missing values) in order of first appearance '''
+    places = df[columns].drop_duplicates()
+    return [[name if isinstance(name, str) else None for name in address]
+            for address in places.itertuples(index=False, name=None)]
+
+
+def _digest(content):
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    ''' Places, input checksums and results of the previous run, stored at path '''
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        if path is not None and os.path.exists(path):
+            try:
+                self.previous = json.load(open(path))
+            except ValueError:
+                print('Manifest ' + path + ' is corrupted, and will be rebuilt')
+
+    def diff(self, places):
+        ''' Places (as tuples) added and removed since the previous run '''
+        before = set(tuple(address) for address in self.previous.get('places', []))
+        now = set(tuple(address) for address in places)
+        return sorted(now - before, key=str), sorted(before - now, key=str)
+
+    def unchanged(self, places, inputs):
+        return (self.path is not None and 'results' in self.previous
+                and self.previous.get('places_digest') == _digest(places)
+                and self.previous.get('inputs') == _digest(inputs))
+
+    def report(self, places, inputs):
+        ''' Print a summary of changes, and return the results of the previous run if they can be reused '''
+        if self.path is None:
+            return None
+        if self.unchanged(places, inputs):
+            print('\nPlaces and inputs unchanged since the previous run, reusing its results\n')
+            return self.previous['results']
+        if 'places' in self.previous:
+            added, removed = self.diff(places)
+            print('\n' + str(len(added)) + ' places added and ' + str(len(removed)) + ' places removed since the previous run')
+            for address in added:
+                print('\t+ ' + ', '.join(str(name) for name in address))
+            for address in removed:
+                print('\t- ' + ', '.join(str(name) for name in address))
+        return None
+
+    def get(self, key, default=None):
+        ''' Entry stored alongside the results of the previous run '''
+        return self.previous.get(key, default)
+
+    def save(self, places, inputs, results, **extra):
+        if self.path is None:
+            return
+        content = {'places': places, 'places_digest': _digest(places), 'inputs': _digest(inputs), 'results': results}
+        content.update(extra)
+        with open(self.path, 'w') as outfile:
+            json.dump(content, outfile, sort_keys=True, indent=1)
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Sequence QC: size of genomes, computed with str.count, without building
+modified copies of each sequence.
+"""
+
+
+# number of bases that are neither N nor gap, the size used for coverage filters
+def sequence_size(seq):
+    return len(seq) - seq.count('N') - seq.count('-')
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Canonical strain names shared by the ingest scripts
+
+    strain_name  -> 'hCoV-19/USA/CT-Yale-1/2021|EPI_ISL_1|2021-01-01' becomes 'USA/CT-Yale-1/2021',
+                    without ' ' (and '_' in the country), and with ' replaced by -
+    gisaid_name  -> strain_name reduced to country/index/year (host removed)
+    simple_name  -> strain_name without '-' and '_', used to detect near-duplicate names
+
+Scalar functions are memoized; normalize_series applies them to a pandas Series,
+normalizing each distinct value only once.
+"""
+
+from functools import lru_cache
+import argparse
+import time
+
+cache_size = 2 ** 20
+
+
+def _clean(field):
+    return field.replace(' ', '').replace('\'', '-')
+
+
+@lru_cache(maxsize=cache_size)
+def strain_name(header):
+    fields = header.split('|', 1)[0].replace('hCoV-19/', '').split('/')
+    fields = [_clean(field) for field in fields]
+    country = 1 if len(fields) == 4 else 0  # after the host, if any
+    fields[country] = fields[country].replace('_', '')
+    return '/'.join(fields)
+
+
+@lru_cache(maxsize=cache_size)
+def gisaid_name(header):
+    ''' strain_name of a GISAID header without the host, or None if it does not have 3 or 4 fields '''
+    fields = strain_name(header).split('/')
+    if len(fields) == 4:  # host/country/index/year
+        fields = fields[1:]
+    if len(fields) != 3:
+        return None
+    return '/'.join(fields)
+
+
+def simple_name(strain):
+    return strain_name(strain).replace('-', '').replace('_', '')
+
+
+def normalize_series(series, form=strain_name):
+    ''' Apply a name normalizer to a pandas Series of names, keeping missing values '''
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series)
+    normalized = pd.Series([form(str(name)) for name in uniques], dtype=object)
+    return pd.Series(normalized.reindex(codes).values, index=series.index)  # code -1 (missing) becomes NaN
+
+
+# original per-script implementation, kept as baseline for the benchmark
+def _replace_chain(header):
+    return header.replace('hCoV-19/', '').split('|')[0].replace(' ', '').replace('\'', '-')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark strain name normalization on synthetic GISAID headers",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--headers", required=False, type=int, default=10000000, help="Number of headers to normalize")
+    parser.add_argument("--unique", required=False, type=int, default=500000, help="Number of distinct headers")
+    args = parser.parse_args()
+
+    total, unique = args.headers, args.unique
+    headers = ['hCoV-19/USA/CT-Yale-' + str(n % unique) + '/2021|EPI_ISL_' + str(n % unique) + '|2021-01-01'
+               for n in range(total)]
+
+    def report(label, function):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        print(label.ljust(30) + str(round(elapsed, 2)).rjust(8) + ' s' +
+              str(int(total / elapsed)).rjust(14) + ' headers/s')
+
+    print('\n### Normalizing ' + str(total) + ' headers (' + str(unique) + ' distinct)\n')
+    report('str.replace chain', lambda: [_replace_chain(h) for h in headers])
+    report('strain_name (no cache)', lambda: [strain_name.__wrapped__(h) for h in headers])
+    report('strain_name (cold cache)', lambda: [strain_name(h) for h in headers])
+    report('strain_name (warm cache)', lambda: [strain_name(h) for h in headers])
+
+    import pandas as pd
+    series = pd.Series(headers)
+    report('pandas .str chain', lambda: series.str.replace('hCoV-19/', '', regex=False).str.split('|').str[0]
+           .str.replace(' ', '', regex=False).str.replace('\'', '-', regex=False))
+    strain_name.cache_clear()
+    report('normalize_series', lambda: normalize_series(series))
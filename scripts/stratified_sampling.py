@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+
+"""
+Stratified sampling of genomes per epiweek, over integer row positions
+
+Categories of the subsampling scheme draw a number of genomes from each epiweek,
+proportional to the genomes available in that epiweek. The metadata frame is
+never filtered or copied: each filter column is partitioned once (row positions
+grouped by value), and genomes already picked are tracked with a boolean mask.
+
+Draws are reproducible: with a seed, each genome gets a pseudo-random key, hashing
+its accession with the seed, the checksum of the scheme and the scheme row, and
+the genomes with the lowest keys of each epiweek are picked. The same inputs give
+the same selection, and as keys do not depend on other genomes, picks of an
+epiweek only change where genomes were added to (or removed from) its pool, or
+where its quota changed. A manifest records the scheme row that selected each genome,
+with a signature of the pool and the quota of its epiweek. In delta mode, genomes
+picked for the same category in the previous run are drawn first: picks of bins
+with unchanged pool and quota are kept as they are, and other bins are topped up
+or trimmed, instead of being sampled again from scratch.
+
+Rows of the scheme can be matched in a pool of processes: workers get the partitions
+and dates of the metadata when they start, and return the candidate rows and keys
+of each category. Candidates are then drawn in order of the scheme, so
+focal categories still take precedence over contextual ones, and results are the
+same as in a sequential run.
+"""
+
+import multiprocessing
+import hashlib
+import copy
+import numpy as np
+import pandas as pd
+
+
+def scheme_digest(scheme):
+    return hashlib.sha1(open(scheme, 'rb').read()).hexdigest()
+
+
+def scheme_seed(seed, scheme):
+    ''' Seed of a sampling run: the user seed, combined with the checksum of the scheme file '''
+    return str(seed) + ':' + scheme_digest(scheme)
+
+
+def category_key(fields):
+    ''' Short identifier of a category of the scheme, from its fields (e.g. filters and dates, but not its size) '''
+    return hashlib.sha1('\t'.join(str(field) for field in fields).encode()).hexdigest()[:12]
+
+
+def epiweek_quotas(counts, sample_size):
+    ''' Genomes to be sampled per epiweek: a share of sample_size proportional to the epiweek pool, rounded up '''
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(len(counts), dtype=int)
+    quotas = np.ceil((counts / total) * sample_size).astype(int)
+    return np.minimum(quotas, counts)
+
+
+class StratifiedSampler:
+    ''' Sample rows of a (read-only) metadata frame per epiweek, without picking a genome twice '''
+    def __init__(self, df, seed=None, bin_column='epiweek', unique_column='gisaid_epi_isl', previous=None):
+        self.df = df
+        self.seed = seed
+        self.rng = np.random.default_rng()
+        self.bins, self.bin_values = pd.factorize(df[bin_column], sort=True)
+        self.dates = df['date'].values
+        # genomes are identified by accession, as rows with the same accession are picked (or dropped) together
+        self.names = df[unique_column].values
+        self.genomes, genome_values = pd.factorize(df[unique_column])
+        self.picked = np.zeros(len(genome_values), dtype=bool)
+        self.partitions = {}
+        self.previous = previous if previous is not None else {}  # {category: {epiweek: (pool, quota, names)}}
+        self.strata = {}  # {category: {epiweek: (pool, quota)}}
+
+    def rows(self, column, value):
+        ''' Positions of rows where column equals value, in row order. Each column is partitioned once '''
+        if column not in self.partitions:
+            codes, values = pd.factorize(self.df[column])
+            if len(values) < np.iinfo(np.int16).max:
+                codes = codes.astype(np.int16)  # stable sorts of small integers are radix sorts
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self.partitions[column] = (order, bounds, {name: code for code, name in enumerate(values)})
+        order, bounds, index = self.partitions[column]
+        if value not in index:
+            return np.zeros(0, dtype=np.intp)
+        code = index[value]
+        return order[bounds[code]:bounds[code + 1]]
+
+    def matches(self, filters, start=None, end=None, include_start=True):
+        ''' Positions of rows matching all (column, value) filters, with dates within start and end '''
+        positions = None
+        for column, value in filters:
+            matches = self.rows(column, value)
+            positions = matches if positions is None else np.intersect1d(positions, matches, assume_unique=True)
+        if positions is None:
+            positions = np.arange(len(self.dates))
+        if start is not None:
+            start = np.datetime64(pd.Timestamp(start))
+            dates = self.dates[positions]
+            positions = positions[dates >= start if include_start else dates > start]
+        if end is not None:
+            positions = positions[self.dates[positions] <= np.datetime64(pd.Timestamp(end))]
+        return positions
+
+    def available(self, positions):
+        ''' Mask of positions whose genomes were not picked yet '''
+        return ~self.picked[self.genomes[positions]]
+
+    def pool(self, filters, start=None, end=None, include_start=True):
+        ''' Positions of rows not picked yet, matching all (column, value) filters, with dates within start and end '''
+        positions = self.matches(filters, start, end, include_start)
+        return positions[self.available(positions)]
+
+    def keys(self, positions, salt):
+        ''' Sorting keys of rows: hashes of their genome names if seeded, uniform draws otherwise '''
+        if self.seed is None:
+            return self.rng.random(len(positions))
+        hash_key = hashlib.md5((str(self.seed) + ':' + str(salt)).encode()).hexdigest()[:16]
+        return pd.util.hash_array(self.names[positions].astype(str).astype(object), hash_key=hash_key)
+
+    def signatures(self, positions, bins, counts, quotas):
+        ''' {epiweek: (pool, quota)}, where pool combines the size of the epiweek pool and the hashes of its genomes '''
+        order = np.argsort(bins, kind='stable')
+        hashes = pd.util.hash_array(self.names[positions[order]].astype(str).astype(object))
+        present = np.flatnonzero(counts)
+        sums = np.add.reduceat(hashes, np.searchsorted(bins[order], present))
+        return {str(self.bin_values[b]): ('%d-%016x' % (counts[b], total), int(quotas[b])) for b, total in zip(present, sums)}
+
+    def changed(self, category):
+        ''' Epiweeks of a category whose pool or quota differ from those of the previous run '''
+        before = {week: entry[:2] for week, entry in self.previous.get(category, {}).items()}
+        now = self.strata.get(category, {})
+        return sorted(week for week in set(before) | set(now) if before.get(week) != now.get(week))
+
+    def draw(self, positions, sample_size, salt='', category=None, keys=None):
+        ''' Sample positions per epiweek, ordered by epiweek; draws are uniform and without replacement within epiweeks '''
+        if category is not None:
+            self.strata[category] = {}
+        if len(positions) == 0:
+            return positions
+        bins = self.bins[positions]
+        counts = np.bincount(bins, minlength=len(self.bin_values))
+        quotas = epiweek_quotas(counts, sample_size)
+
+        # order rows by key within epiweeks, and keep the first ones of each epiweek, up to its quota
+        # genomes picked for the category in the previous run come first, so they are kept while available
+        redraw = np.ones(len(positions), dtype=bool)
+        if category is not None:
+            self.strata[category] = self.signatures(positions, bins, counts, quotas)
+            picked_before = [name for pool, quota, names in self.previous.get(category, {}).values() for name in names]
+            if picked_before:
+                redraw = ~np.isin(self.names[positions], picked_before)
+        if keys is None:
+            keys = self.keys(positions, salt)
+        order = np.lexsort((keys, redraw, bins))
+        sorted_bins = bins[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_bins, sorted_bins, side='left')
+        return positions[order[rank < quotas[sorted_bins]]]
+
+    def take(self, positions):
+        ''' Flag genomes in positions as picked, so they are not sampled again '''
+        self.picked[self.genomes[positions]] = True
+
+    def sample(self, filters, sample_size, start=None, end=None, salt='', include_start=True, category=None):
+        ''' Draw and take genomes for a category of the scheme (identified by salt), returning their row positions '''
+        selected = self.draw(self.pool(filters, start, end, include_start), sample_size, salt, category)
+        self.take(selected)
+        return selected
+
+    def sample_all(self, requests, processes=1):
+        ''' Sample categories of the scheme, in order, returning row positions of each; requests are dicts of sample() arguments '''
+        candidates = None
+        if processes > 1 and len(requests) > 1:
+            for request in requests:
+                for column, value in request['filters']:
+                    self.rows(column, value)  # partition columns before starting workers, so they get them
+            # workers get a copy of the sampler without the frame, as matching rows only needs partitions and dates
+            sampler = copy.copy(self)
+            sampler.df = None
+            with multiprocessing.Pool(min(processes, len(requests)), _init_worker, (sampler,)) as pool:
+                candidates = pool.map(_candidates, requests, chunksize=1)
+
+        selections = []
+        for index, request in enumerate(requests):
+            if candidates is None:
+                selections.append(self.sample(**request))
+                continue
+            positions, keys = candidates[index]
+            mask = self.available(positions)
+            positions = positions[mask]
+            if keys is not None:
+                keys = keys[mask]
+            selected = self.draw(positions, request['sample_size'], request.get('salt', ''), request.get('category'), keys)
+            self.take(selected)
+            selections.append(selected)
+        return selections
+
+    def epiweeks(self, positions):
+        return [str(week) for week in self.bin_values[self.bins[positions]]]
+
+
+_sampler = None  # sampler of a worker process, set when the worker starts
+
+
+def _init_worker(sampler):
+    global _sampler
+    _sampler = sampler
+
+
+def _candidates(request):
+    ''' Rows matching a request, and their keys if seeded (unseeded draws are left to the parent process) '''
+    positions = _sampler.matches(request['filters'], request.get('start'), request.get('end'), request.get('include_start', True))
+    keys = _sampler.keys(positions, request.get('salt', '')) if _sampler.seed is not None else None
+    return positions, keys
+
+
+def read_manifest(path, unique_column='gisaid_epi_isl'):
+    ''' Genomes picked in a previous run, as {category: {epiweek: (pool, quota, names)}} '''
+    previous = {}
+    columns = None
+    for line in open(path, 'r').readlines():
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if columns is None:
+            columns = fields
+            if not {'category', 'epiweek', 'pool', 'quota', unique_column} <= set(columns):
+                print('Manifest ' + path + ' does not list epiweek pools, genomes will be sampled from scratch')
+                return {}
+            continue
+        row = dict(zip(columns, fields))
+        bins = previous.setdefault(row['category'], {})
+        bins.setdefault(row['epiweek'], (row['pool'], int(row['quota']), []))[2].append(row[unique_column])
+    return previous
+
+
+def write_manifest(path, header, columns, rows):
+    ''' TSV of selected genomes and the scheme rows that selected them, after comment lines with header items '''
+    with open(path, 'w') as outfile:
+        for key, value in header.items():
+            outfile.write('# ' + key + ': ' + str(value) + '\n')
+        outfile.write('\t'.join(columns) + '\n')
+        for row in rows:
+            outfile.write('\t'.join(str(value) for value in row) + '\n')
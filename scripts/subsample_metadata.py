@@ -8,7 +8,8 @@
 
 import pandas as pd
 import numpy as np
-from epiweeks import Week
+from epiweek_dates import is_full_date, parse_dates, epiweek_enddates
+from stratified_sampling import StratifiedSampler, scheme_digest, scheme_seed, write_manifest
 import time
 import argparse
 
@@ -25,6 +26,8 @@ if __name__ == '__main__':
     parser.add_argument("--format", required=True, nargs=1, type=str,  default='strain',
                         choices=['strain', 'accession'], help="Output format: list of \'strain\' names or \'accession\' number")
     parser.add_argument("--report", required=False, help="Report listing samples per category")
+    parser.add_argument("--seed", required=False, type=int, default=0, help="Seed of the selection, combined with the checksum of the scheme")
+    parser.add_argument("--manifest", required=False, help="TSV listing the scheme row that selected each genome")
     args = parser.parse_args()
 
     metadata = args.metadata
@@ -34,6 +37,7 @@ if __name__ == '__main__':
     report = args.report
     output = args.output
     format = args.format[0]
+    manifest = args.manifest
 
     # metadata = path + 'pre-analyses/metadata_nextstrain.tsv'
     # keep = None
@@ -94,18 +98,17 @@ if __name__ == '__main__':
 
     print('\n* Dropping sequences with incomplete date...')
     # drop rows with incomplete dates
-    dfN = dfN[dfN['date'].apply(lambda x: len(x.split('-')) == 3)] # accept only full dates
-    dfN = dfN[dfN['date'].apply(lambda x: 'X' not in x)] # exclude -XX-XX missing dates
+    dfN = dfN[is_full_date(dfN['date'])] # accept only full dates, excluding -XX-XX missing dates
 
-    # convert string dates into date format
-    dfN['date'] = pd.to_datetime(dfN['date']) # coverting to datetime format
+    # convert string dates into date format, parsing each distinct date once
+    dfN['date'] = parse_dates(dfN['date']) # coverting to datetime format
+    dfN = dfN[dfN['date'].notna()]
     dfN = dfN.sort_values(by='date')  # sorting lines by date
     start, end = dfN['date'].min(), today
 
     print('\n* Assigning epiweek column...')
     # get epiweek end date, create column
-    dfN['date'] = pd.to_datetime(dfN['date'], errors='coerce')
-    dfN['epiweek'] = dfN['date'].apply(lambda x: Week.fromdate(x, system="cdc").enddate())
+    dfN['epiweek'] = epiweek_enddates(dfN['date'])
 
 
     ## SAMPLE FOCAL AND CONTEXTUAL SEQUENCES
@@ -123,7 +126,11 @@ if __name__ == '__main__':
             subsamplers.append(query)
 
     print('\n* Performing the subsampling...')
-    # perform subsampling
+    # perform subsampling: rows are sampled by position, and genomes already selected are masked
+    # selections only depend on the seed, the scheme and the metadata, so reruns on the same inputs pick the same genomes
+    seed = scheme_seed(args.seed, scheme)
+    sampler = StratifiedSampler(dfN, seed=seed, unique_column='strain')
+    selections = []
     for scheme_dict in subsamplers:
         # print(scheme_dict)
         # group by level
@@ -137,51 +144,42 @@ if __name__ == '__main__':
                 if name not in results[level].keys():
                     results[level][name] = []
 
-            glevel = dfN.groupby(level)
-            for name, dfLevel in glevel:
-                # print(name, dfLevel)
-                if name in names: # check if name is among focal places
-                    min_date, max_date = start, end
-
-                    # define new temporal boundaries, if provided
-                    new_start = dfS.loc[dfS['name'] == name, 'start'].values[0]
-                    new_end = dfS.loc[dfS['name'] == name, 'end'].values[0]
-                    if not pd.isna(new_start):
-                        min_date = new_start
-                    if not pd.isna(new_end):
-                        max_date = new_end
-
-                    # drop any row with dates outside the start/end dates
-                    mask = (dfLevel['date'] > min_date) & (dfLevel['date'] <= max_date)
-                    dfLevel = dfLevel.loc[mask]  # apply mask
-
-                    gEpiweek = dfLevel.groupby('epiweek')
-                    # print(dfS.loc[dfS['name'] == name, 'size'])
-                    sample_size = int(dfS.loc[dfS['name'] == name, 'size'])
-                    total_genomes = dfLevel[level].count()
-                    for epiweek, dfEpiweek in gEpiweek:
-                        bin_pool = dfEpiweek['epiweek'].count() # genomes in bin
-                        sampled = int(np.ceil((bin_pool/total_genomes) * sample_size)) # proportion sampled from bin
-                        # print(epiweek, '-', sampled, '/', bin_pool)
-                        if sampled > bin_pool: # if # requested samples higher than available genomes, get all
-                            sampled = bin_pool
-
-                        # selector
-                        random_subset = dfEpiweek.sample(n=sampled)
-                        selected = random_subset[type].to_list()
-                        results[level][name] = results[level][name] + selected
-
-                    # drop pre-selected samples to prevent duplicates
-                    dfN = dfN[~dfN[level].isin([name])]
+            for name in sorted(set(names)):
+                idx = dfS.index[dfS['name'] == name][0]
+                min_date, max_date = start, end
+
+                # define new temporal boundaries, if provided
+                new_start = dfS.loc[idx, 'start']
+                new_end = dfS.loc[idx, 'end']
+                if not pd.isna(new_start):
+                    min_date = new_start
+                if not pd.isna(new_end):
+                    max_date = new_end
+
+                # genomes per epiweek, proportional to the genomes available in each epiweek, dated after start
+                sample_size = int(dfS.loc[idx, 'size'])
+                selected = sampler.sample([(level, name)], sample_size, min_date, max_date, salt=idx, include_start=False)
+                results[level][name] = results[level][name] + dfN[type].values[selected].tolist()
+                selections.append((idx, dfS.loc[idx, 'purpose'], level, name, selected))
+
+                # drop pre-selected samples to prevent duplicates
+                sampler.take(sampler.rows(level, name))
+
+    if manifest != None:
+        columns = ['row', 'purpose', 'level', 'name', 'epiweek', 'strain']
+        rows = []
+        for idx, category, level, name, selected in selections:
+            rows.extend((idx, category, level, name) + genome for genome in
+                        zip(sampler.epiweeks(selected), dfN['strain'].values[selected]))
+        write_manifest(manifest, {'seed': args.seed, 'scheme': scheme_digest(scheme)}, columns, rows)
 
 
     ### EXPORT RESULTS
     print('\n\n# Genomes sampled per category in subsampling scheme\n')
-    exported = []
+    exported = set()
     genome_count = 0
-    outfile = open(output, 'w')
-    # with open(output, 'w') as outfile, open(report, 'w') as outfile2:
-    outfile.write('# Genomes selected on ' + today + '\n')
+    # lines of the list of genomes, written at once at the end
+    outlines = ['# Genomes selected on ' + today]
 
     if report != None:
         outfile2 = open(report, 'w')
@@ -196,18 +194,20 @@ if __name__ == '__main__':
                     outfile2.write(entry + '\n')
                 print(entry)
 
+                # every sampled genome is listed, even if its name is repeated or listed in keep.txt
                 for strain_name in entries:
-                    if strain_name not in [exported + to_keep]:
-                        outfile.write(strain_name + '\n')
-                        exported.append(strain_name)
+                    outlines.append(strain_name)
+                    exported.add(strain_name)
 
     # report selected samples listed in keep.txt
     print('- ' + str(len(to_keep)) + ' genomes added from pre-selected list\n')
-    outfile.write('\n# Pre-existing genomes listed in keep.txt\n')
+    outlines.append('\n# Pre-existing genomes listed in keep.txt')
     for strain in to_keep:
         if strain not in exported:
-            outfile.write(strain + '\n')
-            exported.append(strain)
+            outlines.append(strain)
+            exported.add(strain)
+    with open(output, 'w') as outfile:
+        outfile.write('\n'.join(outlines) + '\n')
 
     print('\n# Genomes matching the criteria below were not found')
     if report != None:
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+The column-wise apply_scheme of apply_geoscheme.py must reformat metadata exactly
+as the original row-by-row loop did, on the geoscheme shipped in config/
+"""
+
+import itertools
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'scripts'))
+
+from apply_geoscheme import apply_scheme, read_geolevels, colonies, colony_regions, misspelled
+
+geoscheme = os.path.join(root, 'config', 'geoscheme.tsv')
+
+focus_lists = {
+    'caribbean': ['US Virgin Islands', 'Puerto Rico', 'Dominican Republic', 'Anguilla', 'Antigua and Barbuda',
+                  'Aruba', 'Bahamas', 'Barbados', 'Bonaire', 'Sint Eustatius', 'Saba', 'British Virgin Islands',
+                  'Cayman Islands', 'Cuba', 'Curacao', 'Dominica', 'Grenada', 'Guadeloupe', 'Haiti', 'Jamaica',
+                  'Martinique', 'Montserrat', 'Saint Barthelemy', 'Saint Kitts and Nevis', 'Saint Lucia', 'Saint Martin',
+                  'Saint Vincent and the Grenadines', 'Sint Maarten', 'Trinidad and Tobago', 'Turks and Caicos', 'USA',
+                  'Netherlands', 'United Kingdom', 'France'],
+    'connecticut': ['USA', 'Canada', 'United Kingdom', 'Maine', 'New Hampshire',
+                    'Massachusetts', 'Connecticut', 'Vermont', 'New York'],
+    'none': [],
+}
+
+
+# original implementation of apply_geoscheme.py, one row at a time
+def row_loop(dfN, geoLevels, focus):
+    dfN.fillna('', inplace=True)
+    for idx, row in dfN.iterrows():
+
+        # flatten divison names as country names, for countries that are not a focus of study
+        country = dfN.loc[idx, 'country']
+        division = dfN.loc[idx,'division']
+        if country not in focus:
+            if division not in focus:
+                dfN.loc[idx, 'division'] = country
+
+        # assign US region
+        if country not in ['USA']:
+            if 'Europe' in dfN.loc[idx, 'region']:
+                dfN.loc[idx, 'us_region'] = 'Europe'
+            else:
+                dfN.loc[idx, 'us_region'] = 'Global'
+        if country == 'USA' and dfN.loc[idx, 'us_region'] == '':
+            dfN.loc[idx, 'us_region'] = dfN.loc[idx, 'division']
+
+        # divide country into subnational regions
+        division = dfN.loc[idx, 'division']
+        if division not in ['', 'unknown']:
+            if division in geoLevels.keys():
+                dfN.loc[idx, 'country'] = geoLevels[dfN.loc[idx, 'division']]
+
+        # correct ISO codes and regions for colonies (any insular terrritories)
+        island = dfN.loc[idx,'country']
+        if island in colonies.keys():
+            dfN.loc[idx,'iso'] = colonies[island]
+            dfN.loc[idx,'region'] = colony_regions[island]
+
+        # flatten location names as division names for divisions that are not a focus of study
+        if division not in focus:
+            dfN.loc[idx, 'location'] = division
+
+        #rename some commonly misspelled or mismatched data
+        if country in misspelled:
+            dfN.loc[idx,'country'] = misspelled[country]
+        if division in misspelled:
+            dfN.loc[idx,'division'] = misspelled[division]
+        location = dfN.loc[idx,'location']
+        if location in misspelled:
+            dfN.loc[idx,'location'] = misspelled[location]
+
+        #rename Florida, PR
+        if dfN.loc[idx,'country'] in ['Puerto Rico']:
+            if dfN.loc[idx,'location'] in ['Florida']:
+                dfN.loc[idx,'location'] = 'Florida (PR)'
+    return dfN
+
+
+def scheme_names():
+    ''' Names of areas and members of the geoscheme, by type of area '''
+    names = {'region': set(), 'country': set(), 'location': set()}
+    for line in open(geoscheme).readlines()[1:]:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) > 5 and fields[0] in names:
+            names[fields[0]].add(fields[2])
+            names[fields[0]].update(member.strip() for member in fields[5].split(','))
+    return names
+
+
+def metadata(geoLevels):
+    ''' Metadata with addresses combining names of the geoscheme, focus places and corner cases '''
+    names = scheme_names()
+    focus = set(itertools.chain(*focus_lists.values()))
+    countries = sorted(names['region'] | set(colonies) | set(misspelled) | focus) + ['USA', '', 'unknown', None]
+    divisions = sorted(names['country'] | focus | set(misspelled)) + ['Connecticut', 'Florida', '', 'unknown', None]
+    locations = sorted(names['location'] | set(misspelled)) + ['Florida', 'New Haven', '', None]
+    regions = sorted(set(geoLevels.values())) + ['Europe', 'Northern Europe', '', None]
+    isos = sorted(iso for iso in geoLevels if isinstance(iso, str) and len(iso) == 3)
+
+    # every country with a few kinds of divisions, and every division in a few kinds of countries
+    pairs = [(country, division) for country in countries
+             for division in ['', 'unknown', None, 'Connecticut', 'Florida', 'St Eustatius', country]]
+    pairs += [(country, division) for division in divisions
+              for country in ['USA', 'Canada', 'Brazil', 'Puerto Rico', 'Virgin Islands', '']]
+
+    rows = []
+    for number, (country, division) in enumerate(pairs):
+        rows.append({'strain': 'strain/' + str(number), 'country': country, 'division': division,
+                     'location': locations[number % len(locations)], 'region': regions[number % len(regions)],
+                     'iso': isos[number % len(isos)], 'us_region': ''})
+    # Puerto Rico with locations named Florida, before and after flattening
+    for number, division in enumerate(['Florida', 'Puerto Rico', 'San Juan']):
+        rows.append({'strain': 'pr/' + str(number), 'country': 'Puerto Rico', 'division': division,
+                     'location': 'Florida', 'region': 'Caribbean', 'iso': 'PRI', 'us_region': ''})
+    return pd.DataFrame(rows, columns=['strain', 'region', 'country', 'division', 'location', 'iso', 'us_region'])
+
+
+@pytest.fixture(scope='module')
+def geolevels():
+    return read_geolevels(geoscheme)
+
+
+@pytest.mark.parametrize('filt', sorted(focus_lists))
+def test_apply_scheme_matches_row_loop(geolevels, filt):
+    dfN = metadata(geolevels)
+    expected = row_loop(dfN.copy(), geolevels, focus_lists[filt])
+    result = apply_scheme(dfN.copy(), geolevels, focus_lists[filt])
+    pd.testing.assert_frame_equal(result.astype(str), expected.astype(str))